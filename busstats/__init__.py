@@ -0,0 +1,30 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2022 Matej Martinček <matomarss@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+'''
+This decoder stacks on top of one of the 'extractor' decoders (or other stack-decoders having dataBytes output).
+It measures the throughput of every row in bytes per second over a rolling window, the gaps between consecutive
+bytes on every row and the latency of responses on row 0 to requests on row 1 (e.g. MISO after MOSI, RX after TX).
+The statistics are summarized in annotations and as meta output in regular intervals.
+
+All statistics are kept in fixed-size windows and histograms, so the memory used does not grow with the length of
+the capture. The decoder needs to know the samplerate.
+'''
+
+from .pd import Decoder
@@ -0,0 +1,223 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2022 Matej Martinček <matomarss@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+
+import sigrokdecode as srd
+from common.srdhelper import SrdIntEnum
+
+# Number of buckets the rolling throughput window is divided into
+BUCKETS = 16
+# Gaps are counted in bins by the number of bits of their length in samples (bin k holds gaps shorter than 2^k)
+GAP_BINS = 40
+
+a = ['THROUGHPUT', 'THROUGHPUT2', 'GAPS', 'GAPS2', 'LATENCY', ]
+
+Ann = SrdIntEnum.from_list('Ann', a)
+
+class SamplerateError(Exception):
+    pass
+
+def format_time(t):
+    # Time in seconds with a suitable unit
+    if t == 0:
+        return '0 s'
+    for unit, factor in (('s', 1), ('ms', 1e3), ('us', 1e6)):
+        if t * factor >= 1:
+            return '%.3g %s' % (t * factor, unit)
+    return '%.3g ns' % (t * 1e9)
+
+class Decoder(srd.Decoder):
+    api_version = 3
+    id = 'busstats'
+    name = 'Bus statistics'
+    longname = 'Bus throughput and latency statistics'
+    desc = 'Measures throughput, inter-byte gaps and request/response latency of extracted data.'
+    license = 'gplv2+'
+    inputs = ['dataBytes']
+    options = (
+        {'id': 'window', 'desc': 'Length of the rolling throughput window in ms',
+         'default': 1000},
+        {'id': 'report-interval', 'desc': 'Interval between summaries in ms',
+         'default': 1000},
+    )
+    outputs = []
+    tags = ['Debug/trace']
+    annotations = (
+        ('throughput', 'Throughput'),
+        ('throughput2', 'Throughput2'),
+        ('gaps', 'Gaps'),
+        ('gaps2', 'Gaps2'),
+        ('latency', 'Latency'),
+    )
+    annotation_rows = (
+        ('first-throughput', 'First row throughput', (Ann.THROUGHPUT,)),
+        ('second-throughput', 'Second row throughput', (Ann.THROUGHPUT2,)),
+        ('first-gaps', 'First row gaps', (Ann.GAPS,)),
+        ('second-gaps', 'Second row gaps', (Ann.GAPS2,)),
+        ('latency', 'Latency', (Ann.LATENCY,)),
+    )
+
+    def __init__(self):
+        self.report_ss = None
+        self.reset()
+
+    def reset(self):
+        # At the end of the decoding, the summary of the last (possibly shorter) interval is output
+        if self.report_ss is not None:
+            self.report(self.report_ss, self.end)
+
+        self.samplerate = None
+        # Throughput: bytes in the buckets of the rolling window, the number of the last bucket and the sum of all
+        # buckets for each row
+        self.buckets = [[0] * BUCKETS, [0] * BUCKETS]
+        self.bucket = [0, 0]
+        self.window_bytes = [0, 0]
+        # Gaps: end of the previous byte and the histogram of the gaps since the last summary for each row
+        self.last_es = [None, None]
+        self.gaps = [[0] * GAP_BINS, [0] * GAP_BINS]
+        # Latency: end of the last request byte on row 1 not yet answered and the latencies since the last summary
+        self.request_es = None
+        self.latency_count = 0
+        self.latency_sum = 0
+        self.latency_min = None
+        self.latency_max = None
+        # Start of the current summary interval and the end of the last byte of any row
+        self.report_ss = None
+        self.end = 0
+
+    def metadata(self, key, value):
+        if key == srd.SRD_CONF_SAMPLERATE:
+            self.samplerate = value
+            # Sizes of the windows in samples, at least one sample per bucket
+            self.bucket_length = max(1, self.options['window'] * value // (1000 * BUCKETS))
+            self.interval = max(1, self.options['report-interval'] * value // 1000)
+
+    def start(self):
+        self.out_ann = self.register(srd.OUTPUT_ANN)
+        self.out_throughput = [
+            self.register(srd.OUTPUT_META, meta=(int, 'Throughput', 'Bytes per second on the first row')),
+            self.register(srd.OUTPUT_META, meta=(int, 'Throughput2', 'Bytes per second on the second row')),
+        ]
+        self.out_gap = [
+            self.register(srd.OUTPUT_META, meta=(float, 'Gap', 'Median gap between bytes on the first row')),
+            self.register(srd.OUTPUT_META, meta=(float, 'Gap2', 'Median gap between bytes on the second row')),
+        ]
+        self.out_latency = self.register(srd.OUTPUT_META,
+                                         meta=(float, 'Latency', 'Mean latency of responses on the first row'))
+
+    def advance(self, row, sample):
+        # Moves the rolling window of the row to end at the given sample, emptying the buckets it leaves
+        b = sample // self.bucket_length
+        steps = min(b - self.bucket[row], BUCKETS)
+        for i in range(1, steps + 1):
+            k = (self.bucket[row] + i) % BUCKETS
+            self.window_bytes[row] -= self.buckets[row][k]
+            self.buckets[row][k] = 0
+        if steps > 0:
+            self.bucket[row] = b
+
+    def throughput(self, row):
+        # Bytes per second in the rolling window of the row
+        return self.window_bytes[row] * self.samplerate // (self.bucket_length * BUCKETS)
+
+    def gap_percentile(self, row, p):
+        # Upper bound of the gap (in samples) which p percent of the gaps since the last summary do not exceed
+        total = sum(self.gaps[row])
+        count = 0
+        for k, n in enumerate(self.gaps[row]):
+            count += n
+            if count * 100 >= total * p:
+                return (1 << k) - 1
+        return (1 << (GAP_BINS - 1)) - 1
+
+    def to_time(self, samples):
+        return samples / self.samplerate
+
+    def report(self, ss, es):
+        # Outputs the summaries of the interval from ss to es and starts a new one
+        for row in (0, 1):
+            self.advance(row, es)
+            t = self.throughput(row)
+            self.put(ss, es, self.out_ann, [(Ann.THROUGHPUT, Ann.THROUGHPUT2)[row],
+                                            ['Throughput: %d B/s' % t, '%d B/s' % t, 'B/s']])
+            self.put(ss, es, self.out_throughput[row], t)
+
+            if sum(self.gaps[row]) > 0:
+                median = self.to_time(self.gap_percentile(row, 50))
+                p99 = self.to_time(self.gap_percentile(row, 99))
+                self.put(ss, es, self.out_ann, [(Ann.GAPS, Ann.GAPS2)[row],
+                                                ['Gaps: median <= %s, 99%% <= %s' % (format_time(median),
+                                                                                   format_time(p99)),
+                                                 'Gaps: <= %s' % format_time(median), 'Gaps']])
+                self.put(ss, es, self.out_gap[row], median)
+                self.gaps[row] = [0] * GAP_BINS
+
+        if self.latency_count > 0:
+            mean = self.to_time(self.latency_sum / self.latency_count)
+            low, high = self.to_time(self.latency_min), self.to_time(self.latency_max)
+            self.put(ss, es, self.out_ann, [Ann.LATENCY,
+                                            ['Latency: mean %s, min %s, max %s (%d responses)'
+                                             % (format_time(mean), format_time(low), format_time(high),
+                                                self.latency_count),
+                                             'Latency: %s' % format_time(mean), 'Lat']])
+            self.put(ss, es, self.out_latency, mean)
+            self.latency_count = 0
+            self.latency_sum = 0
+            self.latency_min = None
+            self.latency_max = None
+
+    def add_byte(self, ss, es, row):
+        # Throughput
+        self.advance(row, es)
+        self.buckets[row][self.bucket[row] % BUCKETS] += 1
+        self.window_bytes[row] += 1
+
+        # Gap after the previous byte on the same row
+        if self.last_es[row] is not None and ss >= self.last_es[row]:
+            self.gaps[row][min((ss - self.last_es[row]).bit_length(), GAP_BINS - 1)] += 1
+        self.last_es[row] = es
+
+        # A byte on row 1 is a request (the last one of a request counts), the first byte on row 0 starting after it
+        # is the response. Bytes on row 0 received at the same time as the request (e.g. on SPI) are not responses.
+        if row == 1:
+            self.request_es = es
+        elif self.request_es is not None and ss >= self.request_es:
+            latency = ss - self.request_es
+            self.latency_count += 1
+            self.latency_sum += latency
+            self.latency_min = latency if self.latency_min is None else min(self.latency_min, latency)
+            self.latency_max = latency if self.latency_max is None else max(self.latency_max, latency)
+            self.request_es = None
+
+    def decode(self, ss, es, data):
+        if not self.samplerate:
+            raise SamplerateError('Cannot decode without samplerate.')
+        cmd, data_value, row = data
+        if cmd != 'DATA' and cmd != 'ADDRESS':
+            return
+
+        # Output the summary of the previous interval when a byte starts after it
+        if self.report_ss is None:
+            self.report_ss = ss
+        elif ss >= self.report_ss + self.interval:
+            self.report(self.report_ss, self.end)
+            self.report_ss = ss
+
+        self.add_byte(ss, es, row)
+        self.end = max(self.end, es)
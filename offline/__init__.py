@@ -0,0 +1,28 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2022 Matej Martinček <matomarss@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+'''
+Offline tooling for the decoders in this repository.
+
+This is not a decoder and is not meant to be copied into the PulseView decoders directory. It provides a pure-Python
+stand-in for the 'sigrokdecode' module and 'common.srdhelper', so that decoder stacks from this repository can be run
+headless (replay of recorded packet streams, benchmarks, regression checks) without libsigrokdecode.
+'''
+
+from .harness import Stack, load_decoder, read_packets, write_packets
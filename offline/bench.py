@@ -0,0 +1,172 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2022 Matej Martinček <matomarss@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+'''
+Throughput benchmark of the decoder stacks on synthetic packet streams.
+
+For every case, the stream is generated in advance and then decoded by a fresh stack. Reported are the decoded bytes
+per second, annotations per second and the peak memory allocated during the decode (measured in a separate run,
+because tracemalloc slows the decoding down). Results can be saved as JSON and compared with an earlier run:
+
+python -m offline.bench --bytes 200000 --save new.json --compare old.json
+'''
+
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+from .generators import GENERATORS
+from .harness import Stack
+
+EXTRACTORS = {
+    'uart': 'extractor_uart',
+    'spi': 'extractor_spi',
+    'i2c': 'extractor_i2c',
+}
+
+PACKETER_OPTIONS = {
+    'dec': {},
+    'ascii': {'output-format': 'ASCII'},
+    'bin': {'output-format': 'bin'},
+    'hex': {'output-format': 'hex'},
+    'bcd': {'input-binary-format': 'BCD'},
+    'len64': {'max-packet-length': 64},
+    'sep': {'use-separator-sequence': 'yes', 'packet-separator-sequence': 'd,a', 'max-packet-length': 64},
+    'sep-hidden': {'use-separator-sequence': 'yes', 'packet-separator-sequence': 'd,a', 'max-packet-length': 64,
+                   'display-separator-sequence': 'no', 'output-format': 'ASCII'},
+}
+
+# Samplerate of the generated streams for the stacks which need one (10 samples per bit are about 100 kbaud)
+SAMPLERATE = 1000000
+
+def cases():
+    # (name, generator name, stack, options, samplerate) of every benchmark case, the samplerate is None for stacks
+    # which do not need one
+    result = []
+    for bus, extractor in EXTRACTORS.items():
+        for variant, options in PACKETER_OPTIONS.items():
+            result.append(('%s-packeter-%s' % (bus, variant), bus, [extractor, 'packeter'], {'packeter': options},
+                           None))
+    # Pairing of the requests (TX, MOSI) with the responses, with a samplerate for the latency in the annotations
+    result.append(('uart-packeter-pair', 'uart', ['extractor_uart', 'packeter'],
+                   {'packeter': dict(PACKETER_OPTIONS['sep'], **{'pair-packets': 'yes'})}, SAMPLERATE))
+    result.append(('spi-packeter-pair', 'spi', ['extractor_spi', 'packeter'],
+                   {'packeter': {'pair-packets': 'yes'}}, SAMPLERATE))
+    result.append(('uart-busstats', 'uart', ['extractor_uart', 'busstats'],
+                   {'busstats': {'window': 10, 'report-interval': 20}}, SAMPLERATE))
+    result.append(('ds1307fixed', 'ds1307', ['ds1307fixed'], {}, None))
+    result.append(('ds1307-i2c-packeter', 'ds1307', ['extractor_i2c', 'packeter'],
+                   {'packeter': {'output-format': 'hex'}}, None))
+    return result
+
+def data_bytes(bus, packets):
+    # Number of data/address bytes in a packet stream of the given bus (what the extractors pass on)
+    n = 0
+    for _, _, data in packets:
+        cmd = data[0]
+        if bus == 'uart':
+            n += cmd == 'DATA'
+        elif bus == 'spi':
+            if cmd == 'DATA':
+                n += (data[1] is not None) + (data[2] is not None)
+        elif cmd.startswith('ADDRESS ') or cmd.startswith('DATA '):
+            n += 1
+    return n
+
+def decode(stack, options, packets, samplerate=None):
+    s = Stack(stack, options, samplerate)
+    s.run(packets)
+    s.end()
+    return s
+
+def run_case(generator, stack, options, samplerate, count, seed, repeat):
+    packets = list(GENERATORS[generator](seed=seed, count=count))
+    n = data_bytes(generator, packets)
+
+    # Best of several runs to reduce the noise
+    best = None
+    annotations = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        s = decode(stack, options, packets, samplerate)
+        elapsed = time.perf_counter() - start
+        annotations = len(s.annotations)
+        best = elapsed if best is None else min(best, elapsed)
+
+    tracemalloc.start()
+    decode(stack, options, packets, samplerate)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        'stack': stack,
+        'options': options,
+        'packets': len(packets),
+        'bytes': n,
+        'annotations': annotations,
+        'seconds': best,
+        'bytes_per_second': n / best,
+        'annotations_per_second': annotations / best,
+        'peak_memory': peak,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the decoder stacks on synthetic traffic.')
+    parser.add_argument('--bytes', type=int, default=100000, help='data bytes generated for every case')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3, help='number of timed runs of every case')
+    parser.add_argument('-k', '--filter', help='run only cases containing this string')
+    parser.add_argument('--save', help='save the results as JSON to this file')
+    parser.add_argument('--compare', help='compare with results saved earlier')
+    args = parser.parse_args(argv)
+
+    previous = {}
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)['cases']
+
+    results = {}
+    print('%-28s %12s %12s %10s %8s' % ('case', 'bytes/s', 'ann/s', 'peak KiB', 'change'))
+    for name, generator, stack, options, samplerate in cases():
+        if args.filter and args.filter not in name:
+            continue
+        r = results[name] = run_case(generator, stack, options, samplerate, args.bytes, args.seed,
+                                     args.repeat)
+        change = ''
+        if name in previous:
+            change = '%+.1f%%' % (100 * (r['bytes_per_second'] / previous[name]['bytes_per_second'] - 1))
+        print('%-28s %12.0f %12.0f %10.0f %8s' % (name, r['bytes_per_second'], r['annotations_per_second'],
+                                                   r['peak_memory'] / 1024, change))
+        sys.stdout.flush()
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'bytes': args.bytes,
+                'seed': args.seed,
+                'cases': results,
+            }, f, indent=1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2022 Matej Martinček <matomarss@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+'''
+Reader of the columnar export of the Packeter (the export-dir option, the format is described in packeter/export.py).
+
+It does not need the decoders (nor libsigrokdecode), only NumPy. From the root of the repository:
+
+from offline.export import load
+columns = load('export_dir')
+payload_of_packet_i = columns['payload'][columns['offsets'][i] - columns['length'][i]:columns['offsets'][i]]
+'''
+
+import json
+import os
+
+import numpy as np
+
+def load(directory):
+    # Returns a dict of NumPy arrays memory-mapping the columns of an export
+    with open(os.path.join(directory, 'columns.json')) as f:
+        description = json.load(f)
+    columns = {}
+    for name, column in description.items():
+        path = os.path.join(directory, column['file'])
+        dtype = np.dtype(column['dtype'])
+        if os.path.getsize(path) == 0:
+            columns[name] = np.zeros(0, dtype)
+        else:
+            columns[name] = np.memmap(path, dtype, 'r')
+    # A packet may be only partially written while the decoding is going on. The payload is written first, so the
+    # packets of all columns end in it, but a reader may still see a part of a write.
+    packet_columns = [name for name in columns if name != 'payload']
+    n = min(len(columns[name]) for name in packet_columns)
+    n = min(n, int(np.searchsorted(columns['offsets'][:n], len(columns['payload']), 'right')))
+    for name in packet_columns:
+        columns[name] = columns[name][:n]
+    return columns
@@ -0,0 +1,184 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2022 Matej Martinček <matomarss@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+'''
+Seeded generators of synthetic packet streams in the form produced by the 'uart', 'spi' and 'i2c' PDs.
+
+Every generator yields (ss, es, data) tuples, where data is the OUTPUT_PYTHON packet of the lower PD. The same seed
+always gives the same stream. The streams are meant for benchmarks and regression checks of the extractors and the
+decoders stacked on top of them, so only the packets these decoders consume are generated.
+'''
+
+import random
+
+def _bits(value, ss, bit_width, count=8):
+    # Bits of a value as sent MSB first, listed LSB first (like the 'i2c' PD and the 'spi' PD do)
+    bits = []
+    for i in range(count):
+        bit_ss = ss + (count - 1 - i) * bit_width
+        bits.append([(value >> i) & 1, bit_ss, bit_ss + bit_width])
+    return bits
+
+def _line(rng, max_length):
+    # A line of printable ASCII characters terminated by '\r\n'
+    return [rng.randint(32, 126) for _ in range(rng.randint(1, max_length))] + [13, 10]
+
+def uart_packets(seed=0, count=1000, bit_width=10, max_line_length=32):
+    # Yields STARTBIT/DATA/STOPBIT packets of 8N1 frames. Lines of text are sent alternately on TX (row 1,
+    # request) and RX (row 0, response) with an idle gap between them.
+    rng = random.Random(seed)
+    sample = 0
+    sent = 0
+    rxtx = 1
+    while sent < count:
+        for b in _line(rng, max_line_length):
+            if sent == count:
+                break
+            yield sample, sample + bit_width, ['STARTBIT', rxtx, 0]
+            sample += bit_width
+            bits = []
+            for i in range(8):
+                bits.append([(b >> i) & 1, sample + i * bit_width, sample + (i + 1) * bit_width])
+            yield sample, sample + 8 * bit_width, ['DATA', rxtx, (b, bits)]
+            sample += 8 * bit_width
+            yield sample, sample + bit_width, ['STOPBIT', rxtx, 1]
+            sample += bit_width
+            sent += 1
+        sample += rng.randint(20, 200) * bit_width
+        rxtx = 1 - rxtx
+
+def spi_packets(seed=0, count=1000, bit_width=10, max_transfer_length=16, miso=True):
+    # Yields CS-CHANGE/BITS/DATA packets of mode 0 transfers with 8 bit words. MISO data is only present if miso
+    # is True, in which case both MOSI and MISO carry a value in every DATA packet.
+    rng = random.Random(seed)
+    sample = 0
+    sent = 0
+    while sent < count:
+        yield sample, sample, ['CS-CHANGE', 1, 0]
+        sample += bit_width
+        for _ in range(rng.randint(1, max_transfer_length)):
+            if sent == count:
+                break
+            mosi = rng.randint(0, 255)
+            miso_value = rng.randint(0, 255) if miso else None
+            es = sample + 8 * bit_width
+            yield sample, es, ['BITS', _bits(mosi, sample, bit_width),
+                               _bits(miso_value, sample, bit_width) if miso else None]
+            yield sample, es, ['DATA', mosi, miso_value]
+            sample = es
+            sent += 1
+        sample += bit_width
+        yield sample, sample, ['CS-CHANGE', 0, 1]
+        sample += rng.randint(5, 50) * bit_width
+
+def _i2c_byte(sample, bit_width, cmd, value, wire_value, nack=False):
+    # BITS, the address/data packet and the ACK/NACK bit of one byte; wire_value is the byte as sent on the bus
+    es = sample + 8 * bit_width
+    packets = [
+        (sample, es, ['BITS', _bits(wire_value, sample, bit_width)]),
+        (sample, es, [cmd, value]),
+        (es, es + bit_width, ['NACK' if nack else 'ACK', None]),
+    ]
+    return packets, es + bit_width
+
+def i2c_transaction(sample, bit_width, address, writes=(), reads=0, read_values=None):
+    # Packets of one transaction: writes are the data bytes written after ADDRESS WRITE, reads the number of bytes
+    # read after a (repeated) START and ADDRESS READ. Returns the packets and the sample after the STOP condition.
+    packets = [(sample, sample, ['START', None])]
+    sample += bit_width
+    if writes or not reads:
+        p, sample = _i2c_byte(sample, bit_width, 'ADDRESS WRITE', address, address << 1)
+        packets += p
+        for b in writes:
+            p, sample = _i2c_byte(sample, bit_width, 'DATA WRITE', b, b)
+            packets += p
+    if reads:
+        if writes:
+            packets.append((sample, sample, ['START REPEAT', None]))
+            sample += bit_width
+        p, sample = _i2c_byte(sample, bit_width, 'ADDRESS READ', address, (address << 1) | 1)
+        packets += p
+        for i in range(reads):
+            b = read_values[i]
+            p, sample = _i2c_byte(sample, bit_width, 'DATA READ', b, b, nack=(i == reads - 1))
+            packets += p
+    packets.append((sample, sample, ['STOP', None]))
+    return packets, sample + bit_width
+
+def i2c_packets(seed=0, count=1000, bit_width=10, address=0x50, max_transfer_length=16):
+    # Yields START/BITS/ADDRESS */DATA */ACK/NACK/STOP packets of random register writes and reads
+    rng = random.Random(seed)
+    sample = 0
+    sent = 0
+    while sent < count:
+        n = min(rng.randint(1, max_transfer_length), count - sent)
+        if rng.random() < 0.5:
+            packets, sample = i2c_transaction(sample, bit_width, address,
+                                              writes=[rng.randint(0, 255) for _ in range(n)])
+        else:
+            packets, sample = i2c_transaction(sample, bit_width, address, writes=[rng.randint(0, 255)], reads=n,
+                                              read_values=[rng.randint(0, 255) for _ in range(n)])
+        for p in packets:
+            yield p
+        sent += n
+        sample += rng.randint(5, 50) * bit_width
+
+def _int2bcd(i):
+    return ((i // 10) << 4) | (i % 10)
+
+def ds1307_packets(seed=0, count=1000, bit_width=10, other_address=0x50):
+    # Yields the I2C packets of DS1307 date/time reads and writes (with a register pointer write and a repeated
+    # START, with reads starting at the current register pointer, with RAM accesses) and of some traffic to
+    # another slave, which the decoder has to ignore
+    rng = random.Random(seed)
+    sample = 0
+    sent = 0
+    while sent < count:
+        # The full date/time annotation of ds1307fixed indexes days_of_week by the register value itself,
+        # so Saturday (7) is left out of the generated weekdays
+        date_time = [
+            _int2bcd(rng.randint(0, 59)), _int2bcd(rng.randint(0, 59)), _int2bcd(rng.randint(0, 23)),
+            rng.randint(1, 6), _int2bcd(rng.randint(1, 28)), _int2bcd(rng.randint(1, 12)),
+            _int2bcd(rng.randint(0, 99)),
+        ]
+        kind = rng.randint(0, 4)
+        if kind == 0:
+            packets, sample = i2c_transaction(sample, bit_width, 0x68, writes=[0x00] + date_time)
+        elif kind == 1:
+            packets, sample = i2c_transaction(sample, bit_width, 0x68, writes=[0x00], reads=7,
+                                              read_values=date_time)
+        elif kind == 2:
+            packets, sample = i2c_transaction(sample, bit_width, 0x68, reads=3, read_values=date_time[:3])
+        elif kind == 3:
+            ram = [rng.randint(0, 255) for _ in range(rng.randint(1, 8))]
+            packets, sample = i2c_transaction(sample, bit_width, 0x68, writes=[0x08 + rng.randint(0, 40)] + ram)
+        else:
+            packets, sample = i2c_transaction(sample, bit_width, other_address, writes=[rng.randint(0, 255)])
+        for p in packets:
+            yield p
+            if p[2][0] in ('ADDRESS WRITE', 'ADDRESS READ', 'DATA WRITE', 'DATA READ'):
+                sent += 1
+        sample += rng.randint(5, 50) * bit_width
+
+GENERATORS = {
+    'uart': uart_packets,
+    'spi': spi_packets,
+    'i2c': i2c_packets,
+    'ds1307': ds1307_packets,
+}
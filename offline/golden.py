@@ -0,0 +1,446 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2022 Matej Martinček <matomarss@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+'''
+Golden-output regression check of the decoder stacks with a performance budget.
+
+The corpus directory contains recorded packet streams (<bus>.jsonl), the list of cases (cases.json: the input, the
+decoder stack, its options, the samplerate or null and the minimal throughput in bytes per second) and the expected
+annotations of every case (expected/<case>.jsonl, one [ss, es, decoder, annotation class, texts] per line). The
+OUTPUT_PYTHON packets of the top decoder are expected in expected/<case>.python.jsonl (one [ss, es, data] per line),
+which exists only for the cases producing some.
+
+The NumPy front-ends are checked on synthesized captures (captures/<bus>.raw, listed in frontends.json): the packet
+stream they produce must be the expected one (expected/<case>.jsonl in the packet stream format) for every window size
+in FRONTEND_WINDOWS, which checks that the state carried from one window to the next is right.
+
+Every case is also decoded by offline/parallel.py in chunks of the sizes in PARALLEL_CHUNK_SIZES, its output must be
+that of the serial run. The cases with 'packeter' are decoded twice more writing the packet content index and the
+columnar export, which must contain the decoded packets.
+
+python -m offline.golden                    checks all cases, exits with 1 if any of them fails
+python -m offline.golden --update           rewrites the expected annotations after an intended change of the output
+python -m offline.golden --update-budgets   stores the currently measured throughput times --budget-factor
+python -m offline.golden --record           regenerates the inputs, the captures and the lists of cases
+'''
+
+import argparse
+import gc
+import json
+import os
+import sys
+import tempfile
+import time
+from math import ceil, floor
+
+from .bench import cases, data_bytes
+from .generators import GENERATORS
+from .harness import Stack, install, read_packets, write_packets
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpus')
+
+RECORD_SIZE = {
+    'uart': 600,
+    'spi': 600,
+    'i2c': 600,
+    'ds1307': 300,
+}
+
+# Front-end cases: the capture, the front-end and its arguments
+FRONTEND_CASES = [
+    {'name': 'uart-frontend', 'capture': 'uart.raw', 'frontend': 'uart', 'samplerate': 1000000,
+     'options': {'baudrate': 115200, 'rx': 0, 'tx': 1}},
+    {'name': 'spi-frontend', 'capture': 'spi.raw', 'frontend': 'spi',
+     'options': {'clk': 0, 'mosi': 1, 'miso': 2, 'cs': 3}},
+    {'name': 'i2c-frontend', 'capture': 'i2c.raw', 'frontend': 'i2c', 'options': {'scl': 0, 'sda': 1}},
+]
+
+# Window sizes the captures are fed to the front-ends in (None for the whole capture at once)
+FRONTEND_WINDOWS = (7, 100, 4096, None)
+
+# Minimal chunk sizes (in packets) every case is decoded in by offline/parallel.py, small enough for many seams
+PARALLEL_CHUNK_SIZES = (20, 150)
+
+def load_cases(corpus):
+    with open(os.path.join(corpus, 'cases.json')) as f:
+        return json.load(f)
+
+def save_cases(corpus, corpus_cases):
+    with open(os.path.join(corpus, 'cases.json'), 'w') as f:
+        json.dump(corpus_cases, f, indent=1)
+        f.write('\n')
+
+def record(corpus, seed):
+    # Writes the input streams and cases.json, keeping the budgets of cases which already exist
+    os.makedirs(corpus, exist_ok=True)
+    budgets = {}
+    if os.path.exists(os.path.join(corpus, 'cases.json')):
+        budgets = {c['name']: c['min_bytes_per_second'] for c in load_cases(corpus)}
+    for bus, count in RECORD_SIZE.items():
+        write_packets(os.path.join(corpus, bus + '.jsonl'), GENERATORS[bus](seed=seed, count=count))
+    corpus_cases = []
+    for name, bus, stack, options, samplerate in cases():
+        corpus_cases.append({
+            'name': name,
+            'input': bus + '.jsonl',
+            'bus': bus,
+            'stack': stack,
+            'options': options,
+            'samplerate': samplerate,
+            'min_bytes_per_second': budgets.get(name, 0),
+        })
+    save_cases(corpus, corpus_cases)
+    record_captures(corpus, seed)
+
+def record_captures(corpus, seed):
+    # Writes the synthesized captures and frontends.json. The bytes decoded from every capture must be those sent.
+    from .waveforms import CAPTURES
+
+    os.makedirs(os.path.join(corpus, 'captures'), exist_ok=True)
+    for case in FRONTEND_CASES:
+        samples, sent = CAPTURES[case['frontend']](seed=seed)
+        samples.tofile(os.path.join(corpus, 'captures', case['capture']))
+        received = sent_values(case, frontend_packets(case, samples, None))
+        if received != sent:
+            raise RuntimeError('Front-end %s does not decode its synthesized capture.' % case['name'])
+    with open(os.path.join(corpus, 'frontends.json'), 'w') as f:
+        json.dump(FRONTEND_CASES, f, indent=1)
+        f.write('\n')
+
+def sent_values(case, packets):
+    # The values of the packet stream in the form returned by the synthesizers
+    if case['frontend'] == 'uart':
+        values = [[], []]
+        for _, _, data in packets:
+            if data[0] == 'DATA':
+                values[data[1]].append(data[2][0])
+        return values
+    if case['frontend'] == 'spi':
+        data = [data for _, _, data in packets if data[0] == 'DATA']
+        return [[d[1] for d in data], [d[2] for d in data]]
+    if case['frontend'] == 'i2c':
+        return [data for _, _, data in packets if data[0] != 'BITS']
+    raise ValueError('Unknown front-end %r.' % case['frontend'])
+
+def frontend_packets(case, samples, window):
+    # The packet stream of a new front-end fed with windows of the given size (the whole capture if None).
+    # The front-ends need NumPy, so they are imported only here.
+    from .i2c_frontend import I2cFrontend
+    from .samples import windows
+    from .spi_frontend import SpiFrontend
+    from .uart_frontend import UartFrontend
+
+    if case['frontend'] == 'uart':
+        frontend = UartFrontend(case['samplerate'], **case['options'])
+    elif case['frontend'] == 'spi':
+        frontend = SpiFrontend(**case['options'])
+    elif case['frontend'] == 'i2c':
+        frontend = I2cFrontend(**case['options'])
+    else:
+        raise ValueError('Unknown front-end %r.' % case['frontend'])
+    packets = []
+    for w in windows(samples, window or len(samples)):
+        packets += frontend.feed(w)
+    if hasattr(frontend, 'end'):
+        packets += frontend.end()
+    return packets
+
+def uart_reference(case, samples):
+    # The packet stream the 'uart' PD puts for a capture, following it sample by sample: it waits for the falling
+    # edge after the last stop bit, samples the bits at ceil(get_sample_point()) and the packets span floor(half a
+    # bit) before and ceil(half a bit) after the sample point. Like the front-end, frames not complete at the end
+    # of the capture are dropped. Only 8 data bits without parity at the 50 % sample point are supported.
+    options = case['options']
+    bit_width = float(case['samplerate']) / float(options['baudrate'])
+    halfbit = bit_width / 2.0
+    found = []
+    for rxtx, name in enumerate(('rx', 'tx')):
+        if options.get(name) is None:
+            continue
+        line = [(int(v) >> options[name]) & 1 for v in samples]
+        s = 1
+        while s < len(line):
+            if line[s - 1] == 0 or line[s] == 1:
+                s += 1
+                continue
+            points = [ceil((bit_width - 1) * 0.5 + s + bit * bit_width) for bit in range(10)]
+            if points[-1] >= len(line):
+                break
+            if line[points[0]] != 0:
+                s = points[0] + 1
+                continue
+            bits = [[line[p], p - int(halfbit), p + int(halfbit)] for p in points[1:9]]
+            value = sum(b[0] << i for i, b in enumerate(bits))
+            for p, ss, data in ((points[0], points[0], ['STARTBIT', rxtx, 0]),
+                                (points[8], points[1], ['DATA', rxtx, [value, bits]]),
+                                (points[9], points[9], ['STOPBIT', rxtx, line[points[9]]])):
+                found.append((p, rxtx, (ss - floor(halfbit), p + ceil(halfbit), data)))
+            s = points[9] + 1
+    # At the same sample, the PD handles RX before TX
+    return [packet for _, _, packet in sorted(found, key=lambda f: f[:2])]
+
+def packet_lines(packets):
+    # The packets in the format of write_packets()
+    return [json.dumps({'ss': ss, 'es': es, 'data': data}, separators=(',', ':')) for ss, es, data in packets]
+
+def check_frontends(corpus, update, filter=None):
+    # Checks the front-end cases, returns the number of failed ones
+    from .samples import map_raw
+
+    with open(os.path.join(corpus, 'frontends.json')) as f:
+        frontend_cases = json.load(f)
+    failed = 0
+    for case in frontend_cases:
+        if filter and filter not in case['name']:
+            continue
+        samples = map_raw(os.path.join(corpus, 'captures', case['capture']))
+        path = os.path.join(corpus, 'expected', case['name'] + '.jsonl')
+        problems = []
+        if update:
+            with open(path, 'w') as f:
+                f.write(''.join(l + '\n' for l in packet_lines(frontend_packets(case, samples, None))))
+        else:
+            with open(path) as f:
+                expected = f.read().splitlines()
+            for window in FRONTEND_WINDOWS:
+                problem = diff(expected, packet_lines(frontend_packets(case, samples, window)))
+                if problem:
+                    problems.append('windows of %s samples: %s' % (window or 'all', problem))
+            if case['frontend'] == 'uart':
+                # The expected packets are written by the front-end itself, so they are also checked against
+                # the packets the 'uart' PD puts
+                problem = diff(packet_lines(uart_reference(case, samples)), expected)
+                if problem:
+                    problems.append('uart PD reference: %s' % problem)
+
+        print('%-28s %-4s' % (case['name'], 'FAIL' if problems else 'ok'))
+        for p in problems:
+            print('    ' + p)
+        failed += bool(problems)
+    return failed
+
+def decode(case, packets):
+    s = Stack(case['stack'], case['options'], case['samplerate'])
+    s.run(packets)
+    s.end()
+    return s
+
+def parallel_problems(case, packets, outputs):
+    # Differences between the output of the parallel decoding and the serial output for every chunk size
+    from .parallel import decode_parallel
+
+    bus = 'i2c' if case['bus'] == 'ds1307' else case['bus']
+    problems = []
+    for chunk_size in PARALLEL_CHUNK_SIZES:
+        annotations, python = decode_parallel(packets, case['stack'], case['options'], bus, case['samplerate'], 2,
+                                              chunk_size)
+        # The stack is only used for the names of the decoders and their annotation classes
+        stack = Stack(case['stack'], case['options'], case['samplerate'])
+        stack.annotations, stack.python = annotations, python
+        for (what, _, lines), actual in zip(outputs, (annotation_lines(stack), python_lines(stack))):
+            problem = diff(lines, actual)
+            if problem:
+                problems.append('parallel %s in chunks of %d packets: %s' % (what, chunk_size, problem))
+    return problems
+
+def decode_writing(case, packets, option, path):
+    # Decodes the case with the option of 'packeter' (index-file or export-dir) set to the path and, like sigrok-cli,
+    # frees the decoders without resetting them. Returns the packets passed to the writer as
+    # (row, type, ss, es, payload).
+    options = dict(case['options'])
+    options['packeter'] = dict(options.get('packeter', {}), **{option: path})
+    stack = Stack(case['stack'], options, case['samplerate'])
+    packeter = stack.decoders[stack.names.index('packeter')]
+    writer = packeter.index if option == 'index-file' else packeter.export
+    decoded = []
+    add = writer.add
+
+    def record(row, ptype, ss, es, values):
+        decoded.append((row, ptype, ss, es, bytes([v & 0xff for v in values])))
+        add(row, ptype, ss, es, values)
+
+    writer.add = record
+    stack.run(packets)
+    del stack, packeter, writer
+    gc.collect()
+    return decoded
+
+def index_problems(case, packets):
+    # The packet content index must contain the decoded packets and find every byte sequence exactly where they
+    # contain it
+    install()
+    from packeter.index import PacketIndex
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'packets.idx')
+        decoded = decode_writing(case, packets, 'index-file', path)
+        try:
+            index = PacketIndex(path)
+        except ValueError as e:
+            return ['index: %s' % e]
+        problems = []
+        if [index.packet(i) for i in range(len(index))] != decoded:
+            problems.append('index: %d packets decoded, the index contains %d different ones'
+                            % (len(decoded), len(index)))
+        patterns = {p[i:i + k] for _, _, _, _, p in decoded[::7] for k in (1, 3, 5)
+                    for i in range(0, len(p) - k + 1, 3)}
+        for pattern in sorted(patterns):
+            expected = []
+            for i, (row, ptype, ss, es, data) in enumerate(decoded):
+                offset = data.find(pattern)
+                while offset != -1:
+                    expected.append((i, row, ptype, ss, es, offset))
+                    offset = data.find(pattern, offset + 1)
+            if list(index.find(pattern)) != expected:
+                problems.append('index: wrong occurrences of %s' % pattern.hex(','))
+                break
+    return problems
+
+def export_problems(case, packets):
+    # The columns of the export, loaded by offline/export.py, must contain the decoded packets
+    from .export import load
+
+    with tempfile.TemporaryDirectory() as directory:
+        decoded = decode_writing(case, packets, 'export-dir', directory)
+        columns = load(directory)
+        exported = []
+        for i in range(len(columns['ss'])):
+            end = int(columns['offsets'][i])
+            payload = bytes(columns['payload'][end - int(columns['length'][i]):end])
+            exported.append((int(columns['row'][i]), int(columns['type'][i]), int(columns['ss'][i]),
+                             int(columns['es'][i]), payload))
+        if exported != decoded or len(columns['payload']) != sum(len(p) for _, _, _, _, p in decoded):
+            return ['export: %d packets decoded, the export contains %d different ones' % (len(decoded), len(exported))]
+    return []
+
+def annotation_lines(stack):
+    # The annotations in the format of the expected files
+    return [json.dumps([ss, es, stack.names[d], stack.annotation_id(d, cls), list(texts)], ensure_ascii=False)
+            for ss, es, d, cls, texts in stack.annotations]
+
+def python_lines(stack):
+    # The OUTPUT_PYTHON packets of the top decoder in the format of the expected files
+    return [json.dumps([ss, es, data]) for ss, es, data in stack.python]
+
+def read_lines(path):
+    # The lines of an expected file, no lines if it does not exist
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return f.read().splitlines()
+
+def write_lines(path, lines):
+    # Writes an expected file, an empty one is removed
+    if lines:
+        with open(path, 'w') as f:
+            f.write(''.join(l + '\n' for l in lines))
+    elif os.path.exists(path):
+        os.remove(path)
+
+def measure(case, packets, min_time):
+    # Decoded bytes per second, repeating the decode until at least min_time seconds have passed
+    n = data_bytes(case['bus'], packets)
+    runs = 0
+    start = time.perf_counter()
+    while True:
+        decode(case, packets)
+        runs += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            return n * runs / elapsed
+
+def diff(expected, actual):
+    # Description of the first difference between the expected and the actual lines
+    for i in range(min(len(expected), len(actual))):
+        if expected[i] != actual[i]:
+            return 'line %d differs:\n  expected %s\n  actual   %s' % (i, expected[i], actual[i])
+    if len(expected) != len(actual):
+        return '%d lines expected, %d produced' % (len(expected), len(actual))
+    return None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Check the decoder output against the golden corpus.')
+    parser.add_argument('--corpus', default=CORPUS_DIR)
+    parser.add_argument('-k', '--filter', help='check only cases containing this string')
+    parser.add_argument('--update', action='store_true', help='rewrite the expected annotations')
+    parser.add_argument('--update-budgets', action='store_true', help='store the measured throughput as budgets')
+    parser.add_argument('--budget-factor', type=float, default=0.3,
+                        help='fraction of the measured throughput stored by --update-budgets')
+    parser.add_argument('--no-budget', action='store_true', help='skip the throughput check')
+    parser.add_argument('--min-time', type=float, default=0.2, help='seconds spent measuring every case')
+    parser.add_argument('--record', action='store_true',
+                        help='regenerate the inputs, the captures and the lists of cases')
+    parser.add_argument('--seed', type=int, default=0, help='seed used by --record')
+    args = parser.parse_args(argv)
+
+    if args.record:
+        record(args.corpus, args.seed)
+    corpus_cases = load_cases(args.corpus)
+    expected_dir = os.path.join(args.corpus, 'expected')
+    os.makedirs(expected_dir, exist_ok=True)
+
+    failed = 0
+    for case in corpus_cases:
+        if args.filter and args.filter not in case['name']:
+            continue
+        packets = list(read_packets(os.path.join(args.corpus, case['input'])))
+        stack = decode(case, packets)
+        outputs = [
+            ('annotations', os.path.join(expected_dir, case['name'] + '.jsonl'), annotation_lines(stack)),
+            ('python output', os.path.join(expected_dir, case['name'] + '.python.jsonl'), python_lines(stack)),
+        ]
+        problems = []
+
+        for what, path, lines in outputs:
+            if args.update or args.record:
+                write_lines(path, lines)
+            else:
+                problem = diff(read_lines(path), lines)
+                if problem:
+                    problems.append('%s: %s' % (what, problem))
+        if not args.update and not args.record:
+            problems += parallel_problems(case, packets, outputs)
+            if 'packeter' in case['stack']:
+                problems += index_problems(case, packets)
+                problems += export_problems(case, packets)
+
+        speed = ''
+        if not args.no_budget or args.update_budgets:
+            bps = measure(case, packets, args.min_time)
+            speed = '%.0f bytes/s' % bps
+            if args.update_budgets:
+                case['min_bytes_per_second'] = int(bps * args.budget_factor)
+            elif bps < case['min_bytes_per_second']:
+                problems.append('throughput %.0f bytes/s is below the budget of %d bytes/s'
+                                % (bps, case['min_bytes_per_second']))
+
+        print('%-28s %-4s %s' % (case['name'], 'FAIL' if problems else 'ok', speed))
+        for p in problems:
+            print('    ' + p)
+        failed += bool(problems)
+
+    if args.update_budgets:
+        save_cases(args.corpus, corpus_cases)
+    failed += check_frontends(args.corpus, args.update or args.record, args.filter)
+    if failed:
+        print('%d case(s) failed' % failed)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
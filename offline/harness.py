@@ -0,0 +1,236 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2022 Matej Martinček <matomarss@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+'''
+Headless harness running decoder stacks from this repository on recorded packet streams.
+
+A packet stream is what the lowest decoder of the stack would receive from the protocol decoder below it (e.g. the
+'uart', 'spi' or 'i2c' PD). It is stored as JSONL with one packet per line:
+
+{"ss": <start sample>, "es": <end sample>, "data": <OUTPUT_PYTHON data of the lower PD>}
+
+The OUTPUT_PYTHON output of every decoder is fed into the decode() method of the decoder above it. Annotations of all
+decoders and the OUTPUT_PYTHON output of the topmost decoder are collected in column arrays.
+'''
+
+import copy
+import importlib
+import json
+import os
+import sys
+from array import array
+
+from . import profile, srd, srdhelper
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def install():
+    # Make 'sigrokdecode' and 'common.srdhelper' importable for the decoders and the decoders themselves importable
+    if 'sigrokdecode' not in sys.modules:
+        sys.modules['sigrokdecode'] = srd
+    if 'common.srdhelper' not in sys.modules:
+        common = type(sys)('common')
+        common.srdhelper = srdhelper
+        sys.modules['common'] = common
+        sys.modules['common.srdhelper'] = srdhelper
+    if REPO_DIR not in sys.path:
+        sys.path.insert(0, REPO_DIR)
+
+def load_decoder(name):
+    # Returns the Decoder class of the decoder in the directory of the given name (e.g. 'extractor_uart')
+    install()
+    return importlib.import_module(name).Decoder
+
+def decoder_options(cls, options=None):
+    # Like libsigrokdecode, start from the defaults and convert the given values to the type of the default value
+    declared = {o['id']: o for o in cls.options}
+    result = {key: o['default'] for key, o in declared.items()}
+    for key, value in (options or {}).items():
+        if key not in declared:
+            raise ValueError('Decoder %s has no option %s.' % (cls.id, key))
+        default = declared[key]['default']
+        if isinstance(default, int):
+            value = int(value)
+        elif isinstance(default, float):
+            value = float(value)
+        else:
+            value = str(value)
+        if 'values' in declared[key] and value not in declared[key]['values']:
+            raise ValueError('Invalid value %r of option %s.' % (value, key))
+        result[key] = value
+    return result
+
+def read_packets(path):
+    # Yields (ss, es, data) for every packet of a JSONL packet stream
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                p = json.loads(line)
+                yield p['ss'], p['es'], p['data']
+
+def write_packets(path, packets):
+    with open(path, 'w') as f:
+        for ss, es, data in packets:
+            f.write(json.dumps({'ss': ss, 'es': es, 'data': data}, separators=(',', ':')) + '\n')
+
+class AnnotationStore:
+    # Annotations in columns: ss/es, index of the decoder in the stack, annotation class and the texts.
+    # Identical lists of texts (which are very common) are stored only once and referenced by their index.
+    def __init__(self):
+        self.ss = array('Q')
+        self.es = array('Q')
+        self.decoder = array('B')
+        self.cls = array('H')
+        self.text_ids = array('I')
+        self.texts = []
+        self.text_index = {}
+
+    def __len__(self):
+        return len(self.ss)
+
+    def append(self, ss, es, decoder, cls, texts):
+        texts = tuple(texts)
+        i = self.text_index.get(texts)
+        if i is None:
+            i = self.text_index[texts] = len(self.texts)
+            self.texts.append(texts)
+        self.ss.append(ss)
+        self.es.append(es)
+        self.decoder.append(decoder)
+        self.cls.append(cls)
+        self.text_ids.append(i)
+
+    def extend(self, other, start=0):
+        # Appends the annotations of another store, starting with its annotation no. start
+        text_ids = []
+        for texts in other.texts:
+            i = self.text_index.get(texts)
+            if i is None:
+                i = self.text_index[texts] = len(self.texts)
+                self.texts.append(texts)
+            text_ids.append(i)
+        self.ss.extend(other.ss[start:])
+        self.es.extend(other.es[start:])
+        self.decoder.extend(other.decoder[start:])
+        self.cls.extend(other.cls[start:])
+        self.text_ids.extend(array('I', [text_ids[i] for i in other.text_ids[start:]]))
+
+    def __iter__(self):
+        for i in range(len(self.ss)):
+            yield self.ss[i], self.es[i], self.decoder[i], self.cls[i], self.texts[self.text_ids[i]]
+
+class PythonStore:
+    def __init__(self):
+        self.ss = array('Q')
+        self.es = array('Q')
+        self.data = []
+
+    def __len__(self):
+        return len(self.ss)
+
+    def append(self, ss, es, data):
+        self.ss.append(ss)
+        self.es.append(es)
+        self.data.append(data)
+
+    def extend(self, other, start=0):
+        self.ss.extend(other.ss[start:])
+        self.es.extend(other.es[start:])
+        self.data.extend(other.data[start:])
+
+    def __iter__(self):
+        return zip(self.ss, self.es, self.data)
+
+class Stack:
+    # A stack of decoder instances, the first one receives the packets passed to decode(). The decoders are profiled
+    # if profile_path is given, see offline/profile.py.
+    def __init__(self, names, options=None, samplerate=None, profile_path=None):
+        options = options or {}
+        self.names = list(names)
+        self.annotations = AnnotationStore()
+        self.python = PythonStore()
+        self.decoders = []
+        self.profiler = profile.profiler(profile_path)
+        for name in self.names:
+            cls = load_decoder(name) if self.profiler is None else self.profiler.load(name, load_decoder)
+            d = self.call(len(self.decoders), 'init', cls)
+            d.options = decoder_options(cls, options.get(name))
+            d._session = self
+            d._routes = []
+            self.decoders.append(d)
+        for i, d in enumerate(self.decoders):
+            if samplerate is not None and hasattr(d, 'metadata'):
+                self.call(i, 'metadata', d.metadata, srd.SRD_CONF_SAMPLERATE, samplerate)
+            self.call(i, 'start', d.start)
+        self.decode = self.decoders[0].decode
+
+    def call(self, i, what, function, *args):
+        # Calls a function of the setup of decoder i, timing it if profiling is enabled
+        if self.profiler is None:
+            return function(*args)
+        return self.profiler.timed(self.profiler.decoders[i], what, function, *args)
+
+    def route(self, d, output_type, proto_id, meta):
+        # Returns the function handling the put() calls of decoder d for the registered output
+        i = self.decoders.index(d)
+        if output_type == srd.OUTPUT_ANN:
+            annotations = self.annotations
+            return lambda ss, es, data: annotations.append(ss, es, i, data[0], data[1])
+        if output_type == srd.OUTPUT_PYTHON:
+            if i + 1 < len(self.decoders):
+                return self.decoders[i + 1].decode
+            return self.python.append
+        return lambda ss, es, data: None
+
+    def run(self, packets):
+        decode = self.decode
+        for ss, es, data in packets:
+            decode(ss, es, data)
+        return self
+
+    def snapshot(self):
+        # Copy of the state of all decoders (their attributes, except the ones set up by the harness)
+        return [copy.deepcopy({k: v for k, v in vars(d).items() if not k.startswith('_')}) for d in self.decoders]
+
+    def restore(self, snapshot):
+        # setattr() keeps the optimized attribute storage of the instances, updating vars(d) would make every
+        # attribute access of the decoders slower
+        for d, state in zip(self.decoders, copy.deepcopy(snapshot)):
+            for key, value in state.items():
+                setattr(d, key, value)
+
+    def same_state(self, other):
+        # True if all decoders of both stacks are in the same state, i.e. they will decode the rest identically
+        for d, o in zip(self.decoders, other.decoders):
+            state = {k: v for k, v in vars(d).items() if not k.startswith('_')}
+            if state != {k: v for k, v in vars(o).items() if not k.startswith('_')}:
+                return False
+        return True
+
+    def end(self):
+        # Like srd_session_terminate_reset(), let every decoder reset itself at the end of the stream
+        for d in self.decoders:
+            if hasattr(d, 'reset'):
+                d.reset()
+        if self.profiler is not None:
+            self.profiler.report(self)
+
+    def annotation_id(self, decoder, cls):
+        # Returns the id of the annotation class (e.g. 'data2') for the class index of the given decoder
+        return type(self.decoders[decoder]).annotations[cls][0]
@@ -0,0 +1,196 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2022 Matej Martinček <matomarss@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+'''
+Vectorized I2C front-end replacing the 'i2c' PD for offline decoding of large captures.
+
+START and STOP conditions are found as SDA edges while SCL is high, the SDA bits are sampled at all SCL rising edges
+between a START and the next condition and split into bytes of 8 data bits and an ACK/NACK bit, all in vectorized
+operations. The result is the packet stream of the 'i2c' PD (with the default 'shifted' address format):
+
+['START', None] / ['START REPEAT', None] / ['STOP', None]
+['BITS', [[<bit>, <ss>, <es>], ...]]    (only if bits is True, 'ds1307fixed' needs them)
+['ADDRESS READ', <address>] / ['ADDRESS WRITE', <address>] / ['DATA READ', <byte>] / ['DATA WRITE', <byte>]
+['ACK', None] / ['NACK', None]
+
+which 'extractor_i2c' and 'ds1307fixed' consume. The bits are listed LSB first like the 'i2c' PD lists them.
+10-bit addressing is not supported.
+'''
+
+import argparse
+
+import numpy as np
+
+from . import profile
+from .harness import Stack, write_packets
+from .replay import parse_options, print_annotations
+from .samples import channel, open_capture, rising_edges, runs
+
+class I2cFrontend:
+    def __init__(self, scl, sda, bits=True):
+        self.scl, self.sda = scl, sda
+        self.bits = bits
+        self.weights = np.left_shift(1, np.arange(8, dtype=np.int64))[::-1].copy()
+
+        # The last sample of the previous window (for edge detection across windows) and its sample number
+        self.prev = None
+        self.base = 0
+        # State of the transfer at the end of the previous window: whether a START was the last condition,
+        # whether its address byte was already received and its R/W bit (1 for read)
+        self.started = False
+        self.addressed = False
+        self.read = 0
+        # Sample numbers and SDA bits of the SCL rising edges of the byte not completed in the previous window
+        self.pending = (np.zeros(0, np.int64), np.zeros(0, np.uint8))
+
+    def feed(self, samples):
+        # Returns the packets of all conditions and all bytes completed in this window of packed samples
+        buf = samples if self.prev is None else np.concatenate((self.prev, samples))
+        base = self.base
+        scl = channel(buf, self.scl)
+        sda = channel(buf, self.sda)
+
+        # START (SDA falling) and STOP (SDA rising) conditions while SCL is high
+        sda_edges = np.flatnonzero(sda[1:] != sda[:-1]) + 1
+        conditions = sda_edges[(scl[sda_edges] == 1) & (scl[sda_edges - 1] == 1)]
+        is_start = sda[conditions] == 0
+        starts = is_start.tolist()
+        after_start = [self.started] + starts[:-1]
+        events = []
+        for pos, start, repeat in zip((conditions + base).tolist(), starts, after_start):
+            cmd = ('START REPEAT' if repeat else 'START') if start else 'STOP'
+            events.append((pos, (pos, pos, [cmd, None])))
+
+        # Every rising edge of SCL belongs to the transfer started by the last condition before it (transfer 0 is
+        # the one going on at the start of this window), only the edges of transfers started by a START count
+        rises = rising_edges(scl)
+        positions = np.concatenate((self.pending[0], rises + base))
+        bits = np.concatenate((self.pending[1], sda[rises]))
+        transfer = np.searchsorted(conditions + base, positions, side='right')
+        counted = np.concatenate(([self.started], is_start))[transfer]
+        positions, bits, transfer = positions[counted], bits[counted], transfer[counted]
+
+        rank, size = runs(transfer)
+        last = len(conditions)
+        open_end = self.started if last == 0 else starts[-1]
+        # A byte is complete after its 8th bit, the ACK/NACK bit is taken if it is there. In the transfer still
+        # going on at the end of the window, the ACK/NACK bit may yet come, so only bytes with it are complete.
+        data_end = rank - rank % 9 + 8
+        first = (rank % 9 == 0) & ((data_end <= size) & ~(open_end & (transfer == last)) | (data_end < size))
+        first = np.flatnonzero(first)
+        has_ack = rank[first] + 8 < size[first]
+
+        if open_end:
+            rest = (transfer == last) & (rank >= size - size % 9)
+            self.pending = (positions[rest], bits[rest])
+        else:
+            self.pending = (np.zeros(0, np.int64), np.zeros(0, np.uint8))
+
+        # The first byte of every transfer is the address, except in transfer 0 if it was already received
+        byte_transfer = transfer[first]
+        is_address = rank[first] == 0
+        if self.addressed:
+            is_address &= byte_transfer != 0
+        values = bits[first[:, None] + np.arange(8)] @ self.weights
+        read = np.full(last + 1, -1, np.int64)
+        read[0] = self.read if self.addressed else -1
+        read[byte_transfer[is_address]] = values[is_address] & 1
+        byte_read = read[byte_transfer]
+
+        events += self.bytes(positions, bits, first, has_ack, values, is_address, byte_read)
+        events.sort(key=lambda e: e[0])
+
+        if last > 0:
+            self.addressed = bool(np.any(is_address & (byte_transfer == last)))
+        else:
+            self.addressed = self.addressed or bool(np.any(is_address))
+        self.read = int(read[last])
+        self.started = open_end
+        self.prev = buf[-1:]
+        self.base = base + len(buf) - 1
+        return [p for _, p in events]
+
+    def bytes(self, positions, bits, first, has_ack, values, is_address, byte_read):
+        # (sample at which the 'i2c' PD puts them, packet) of the packets of all bytes
+        if len(first) == 0:
+            return []
+        edges = positions[np.minimum(first[:, None] + np.arange(9), len(positions) - 1)]
+        # Every bit lasts until the next rising edge of SCL, the 8th and the ACK/NACK bit as long as the one before
+        width = edges[:, 7] - edges[:, 6]
+        ends = np.concatenate((edges[:, 1:8], (edges[:, 7] + width)[:, None]), axis=1)
+        ss = edges[:, 0].tolist()
+        es = ends[:, 7].tolist()
+        data_at = edges[:, 7].tolist()
+        ack_at = edges[:, 8].tolist()
+        ack_es = (edges[:, 8] + width).tolist()
+        ack_bits = bits[np.minimum(first + 8, len(bits) - 1)].tolist()
+        values = values.tolist()
+        has_ack = has_ack.tolist()
+        is_address = is_address.tolist()
+        byte_read = byte_read.tolist()
+        if self.bits:
+            bit_lists = [[list(b) for b in zip(*byte)] for byte in zip(
+                bits[first[:, None] + np.arange(8)][:, ::-1].tolist(), edges[:, 7::-1].tolist(),
+                ends[:, ::-1].tolist())]
+
+        events = []
+        for i in range(len(ss)):
+            if is_address[i]:
+                packet = ['ADDRESS READ' if byte_read[i] else 'ADDRESS WRITE', values[i] >> 1]
+            elif byte_read[i] >= 0:
+                packet = ['DATA READ' if byte_read[i] else 'DATA WRITE', values[i]]
+            else:
+                continue
+            if self.bits:
+                events.append((data_at[i], (ss[i], es[i], ['BITS', bit_lists[i]])))
+            events.append((data_at[i], (ss[i], es[i], packet)))
+            if has_ack[i]:
+                events.append((ack_at[i], (ack_at[i], ack_es[i], ['NACK' if ack_bits[i] else 'ACK', None])))
+        return events
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Decode I2C from a raw or .sr capture and run a decoder stack.')
+    parser.add_argument('capture', help='.sr session or raw file of packed samples')
+    parser.add_argument('--samplerate', type=int, help='samplerate (taken from the metadata of .sr sessions)')
+    parser.add_argument('--unitsize', type=int, default=1, help='bytes per sample of a raw file')
+    parser.add_argument('--scl', type=int, required=True, help='channel index of SCL')
+    parser.add_argument('--sda', type=int, required=True, help='channel index of SDA')
+    parser.add_argument('-s', '--stack', default='extractor_i2c,packeter',
+                        help='comma separated decoder directories stacked on top of the front-end')
+    parser.add_argument('-o', '--option', action='append', help='decoder option as decoder:option=value')
+    parser.add_argument('--write', help='write the I2C packet stream to this JSONL file instead of decoding it')
+    parser.add_argument('--json', action='store_true', help='print annotations as JSONL')
+    parser.add_argument('--profile', help='profile the decoders and append the report to this file (- for stderr)')
+    args = parser.parse_args(argv)
+
+    samplerate, chunks = open_capture(args.capture, args.samplerate, args.unitsize)
+    frontend = I2cFrontend(args.scl, args.sda)
+    if args.write:
+        write_packets(args.write, (p for chunk in chunks for p in frontend.feed(chunk)))
+        return
+
+    stack = Stack(args.stack.split(','), parse_options(args.option), samplerate,
+                  profile.command_line_path(args.profile))
+    for chunk in chunks:
+        stack.run(frontend.feed(chunk))
+    stack.end()
+    print_annotations(stack, args.json)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,468 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2022 Matej Martinček <matomarss@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+'''
+Parallel decoding of long packet streams in a process pool.
+
+The stream is split into chunks at bus-idle boundaries: after an I2C STOP, after SPI CS# is deasserted or at a gap
+between two UART packets longer than a threshold. Every chunk is decoded by a stack in a worker process.
+
+At a bus-idle boundary, the extractors are in their initial state, but the decoders above them are not: 'packeter'
+keeps the unfinished packet of every row and with the default framing by length, its packet boundaries depend on
+everything decoded before. So for a stack of an extractor and 'packeter', the workers first run the extractor over
+their chunks and summarize the framing of the bytes of every row: where a packet started at any of the few positions
+that matter (the first bytes, the first separator, the first change of the type) would leave the last packet of the
+chunk. The state of the packeter rows at every seam follows from the summaries of the chunks before it in a pass
+over the summaries only, comparing the separators by the code of the packeter itself. Then the workers decode the
+bytes the extractor passed on (returned in a compact form by the first run) from those states. Other stacks start every chunk in
+the initial state.
+
+The chunks are merged in order, carrying the state of the decoders across the seams. If the state at the end of the
+previous chunk differs from the state the worker started from (e.g. in the attributes the extractors set from the
+last packet, or 'ds1307fixed' keeping the register pointer between transfers), the chunk is decoded from the carried
+state in lockstep with a stack started from the same state as the worker, until both get into the same state. From
+then on, the output of the worker is used. If they do not get into the same state soon, the rest of the stream is
+decoded serially in a single pass. Either way, the merged annotations are exactly those of a serial run, in the same
+order.
+
+Raw captures are decoded by writing the packet stream of a front-end first (the --write option of the front-ends).
+
+Example:
+python -m offline.parallel -j 32 --bus i2c -s extractor_i2c,packeter capture.jsonl
+'''
+
+import argparse
+import copy
+import multiprocessing
+import sys
+import time
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
+
+from .bench import EXTRACTORS
+from .harness import AnnotationStore, PythonStore, Stack, read_packets
+from .replay import parse_options, print_annotations
+
+def boundaries(packets, bus, idle=1000, cs_polarity='active-low'):
+    # Indices of the packets before which the stream may be split
+    result = []
+    if bus == 'i2c':
+        for i, (_, _, data) in enumerate(packets):
+            if data[0] == 'STOP':
+                result.append(i + 1)
+    elif bus == 'spi':
+        inactive = 1 if cs_polarity == 'active-low' else 0
+        for i, (_, _, data) in enumerate(packets):
+            if data[0] == 'CS-CHANGE' and data[2] == inactive:
+                result.append(i + 1)
+    elif bus == 'uart':
+        result = [i for i, (previous, packet) in enumerate(zip(packets, packets[1:]), 1)
+                  if packet[0] - previous[1] > idle]
+    else:
+        raise ValueError('Unknown bus %r.' % bus)
+    return [i for i in result if 0 < i < len(packets)]
+
+def split(packets, bus, chunk_size, idle=1000, cs_polarity='active-low'):
+    # Chunks of at least chunk_size packets (except the last one) split at the first boundary after that size
+    chunks = []
+    start = 0
+    for b in boundaries(packets, bus, idle, cs_polarity):
+        if b - start >= chunk_size:
+            chunks.append(packets[start:b])
+            start = b
+    if start < len(packets):
+        chunks.append(packets[start:])
+    return chunks
+
+class Framing:
+    # Where the packets of 'packeter' end (the framing only, without formatting or outputting the packets). The
+    # separators are compared with the values by the code of the decoder itself, on an instance only used for that.
+    def __init__(self, options):
+        self.packeter = Stack(['packeter'], {'packeter': options}).decoders[0]
+        self.max_length = self.packeter.options['max-packet-length']
+        self.separator_length = len(self.packeter.separation_sequence)
+        self.matching_cache = {}
+
+    def match(self, values, pointers):
+        # Separator pointers after the values of a packet following the given pointers and the index of the value
+        # completing the separator (None if no value does)
+        d = self.packeter
+        d.current_row = 0
+        d.separation_sequence_pointer_set[0] = set(pointers)
+        for i, v in enumerate(values):
+            d.move_separation_sequence_pointer(v)
+            if d.is_separated_by_sequence():
+                return d.separation_sequence_pointer_set[0], i
+        return d.separation_sequence_pointer_set[0], None
+
+    def pointers(self, values):
+        # Separator pointers after the values of an unfinished packet, only the last values can be part of a
+        # separator not completed yet
+        n = self.separator_length - 1
+        if n <= 0:
+            return {0}
+        return self.match(values[-n:], {0})[0]
+
+    def matching(self, value):
+        # Positions in the separator which the value matches
+        m = self.matching_cache.get(value)
+        if m is None:
+            pointers = self.match([value], range(self.separator_length))[0]
+            m = self.matching_cache[value] = frozenset(p - 1 for p in pointers if p > 0)
+        return m
+
+    def separator_ends(self, values):
+        # Indices of the values completing an occurrence of the separator
+        n = self.separator_length
+        if n == 0:
+            return []
+        last = {v for v in set(values) if n - 1 in self.matching(v)}
+        return [i for i in range(n - 1, len(values)) if values[i] in last
+                and all(k in self.matching(values[i - n + 1 + k]) for k in range(n - 1))]
+
+    def summary(self, cmds, values, ss, es):
+        # Summary of the bytes of a row in a chunk, from which advance() computes the state of the row at the end
+        # of the chunk for any state at its start. ss(i) is the start of byte i.
+        m = len(values)
+        length = self.max_length
+        ends = self.separator_ends(values)
+        changes = [i for i in range(1, m) if cmds[i] != cmds[i - 1]] if len(set(cmds)) > 1 else []
+
+        # Positions before which a packet may be finished regardless of its length (after a separator ending with
+        # the previous byte, if the packet starts at least minimal[f] bytes before, or before a byte of the other
+        # type) and for each of them the start of the last packet started in the chunk and whether it ends with
+        # the last byte, if a packet starts at the position
+        minimal = {e + 1: self.separator_length for e in ends}
+        minimal.update((c, 1) for c in changes)
+        forced = sorted(minimal)
+        results = {}
+
+        def result(x):
+            # For a packet starting at x: packets of the maximal length follow until one of them contains a forced
+            # position far enough from its start
+            for i in range(bisect_right(forced, x), len(forced)):
+                f = forced[i]
+                y = x + (f - 1 - x) // length * length if length else x
+                if f - y >= minimal[f]:
+                    return (y, True) if f == m else results[f]
+            if not length:
+                return x, False
+            y = x + (m - 1 - x) // length * length
+            return y, y + length == m
+
+        for f in reversed(forced):
+            if f < m:
+                results[f] = result(f)
+
+        starts = {0, ends[0] + 1 if ends else m, changes[0] if changes else m}
+        starts.update(range(1, max(length, self.separator_length) + 1))
+        moves = {}
+        for p in starts:
+            if p < m:
+                q, done = result(p)
+                moves[p] = (q, ss(q), done)
+        # The unfinished packet may also continue the packet unfinished at the start of the chunk
+        whole = not forced and (length == 0 or m < length)
+        tail = 0 if whole else min([q for q, _, done in moves.values() if not done] + [m])
+        return {
+            'length': m,
+            'first_cmd': cmds[0],
+            'last_cmd': cmds[-1],
+            'head': list(values[:self.separator_length]),
+            'first_end': ends[0] if ends else None,
+            'first_change': changes[0] if changes else None,
+            'moves': moves,
+            'tail': tail,
+            'values': list(values[tail:]),
+            'es': es,
+        }
+
+    def advance(self, row, summary):
+        # The state of a row (the row attributes of the packeter as a dict) after the bytes of a chunk
+        if summary is None:
+            return row
+        m = summary['length']
+        state = row['state']
+        stored = row['stored_values']
+        if state == 'NEUTRAL' or state != summary['first_cmd']:
+            # A new packet starts with the first byte
+            start = 0
+        else:
+            # The first position after the end of the packet unfinished at the start of the chunk
+            ends = []
+            if self.max_length:
+                ends.append(self.max_length - len(stored))
+            if self.separator_length:
+                i = self.match(summary['head'], row['separation_sequence_pointer_set'])[1]
+                if i is not None:
+                    ends.append(i + 1)
+                if summary['first_end'] is not None:
+                    ends.append(summary['first_end'] + 1)
+            if summary['first_change'] is not None:
+                ends.append(summary['first_change'])
+            start = min(ends) if ends and min(ends) <= m else None
+
+        row = dict(row, es=summary['es'])
+        if start is None:
+            # The packet continues over the whole chunk
+            row['stored_values'] = stored + summary['values']
+            row['separation_sequence_pointer_set'] = self.pointers(row['stored_values'])
+        elif start == m:
+            row.update(state='NEUTRAL', stored_values=[], separation_sequence_pointer_set={0})
+        else:
+            q, ss, done = summary['moves'][start]
+            row['ss'] = ss
+            if done:
+                row.update(state='NEUTRAL', stored_values=[], separation_sequence_pointer_set={0})
+            else:
+                values = summary['values'][q - summary['tail']:]
+                row.update(state=summary['last_cmd'], stored_values=values,
+                           separation_sequence_pointer_set=self.pointers(values))
+        return row
+
+ROW_KEYS = ('ss', 'es', 'state', 'stored_values', 'separation_sequence_pointer_set')
+
+def frame(names, options, samplerate, packets):
+    # Runs the extractor (the first decoder) over the packets. Returns the summaries of both rows of the bytes it
+    # passes to 'packeter', the row of the last of them (None if there is none), the state of the extractor at the
+    # end and the bytes in the compact form taken by decode_bytes(), which is cheap to pass between processes.
+    stack = Stack(names[:1], options, samplerate)
+    stack.run(packets)
+    ss, es, data = stack.python.ss, stack.python.es, stack.python.data
+    cmds = [d[0] for d in data]
+    values = [d[1] for d in data]
+    rows = bytes([d[2] for d in data])
+    kinds = sorted(set(cmds))
+    codes = bytes([kinds.index(c) for c in cmds]) if len(kinds) > 1 else bytes(len(cmds))
+
+    framing = Framing(options.get('packeter'))
+    summaries = []
+    for r in (0, 1):
+        index = [i for i in range(len(rows)) if rows[i] == r and (cmds[i] == 'DATA' or cmds[i] == 'ADDRESS')]
+        if not index:
+            summaries.append(None)
+            continue
+        summaries.append(framing.summary([cmds[i] for i in index], [values[i] for i in index],
+                                         lambda q: ss[index[q]], es[index[-1]]))
+    current_row = rows[-1] if rows else None
+    return summaries, current_row, stack.snapshot()[0], (ss, es, kinds, codes, values, rows)
+
+def packeter_state(framing, state, summaries, current_row):
+    # The state of the stack (with 'packeter' second) after a chunk with the given summaries
+    state = copy.copy(state)
+    packeter = state[1] = dict(state[1])
+    for r, summary in enumerate(summaries):
+        row = framing.advance({k: packeter[k][r] for k in ROW_KEYS}, summary)
+        for k in ROW_KEYS:
+            packeter[k] = list(packeter[k])
+            packeter[k][r] = row[k]
+    if current_row is not None:
+        packeter['current_row'] = current_row
+    return state
+
+def start_states(initial, frames, options):
+    # Yields the state every chunk is decoded from and its result of frame() (None if it failed). The first chunk
+    # starts from the initial state, the following ones from the state computed from the results of the chunks
+    # before them.
+    framing = Framing(options.get('packeter'))
+    state = initial
+    for framed in frames:
+        yield state, framed
+        if framed is None:
+            # The state after the chunk is not known, the chunks following it are repaired
+            state = initial
+        else:
+            state = packeter_state(framing, state, framed[0], framed[1])
+
+# The chunks of the stream being decoded. Pickling the packets costs more than decoding them, so the worker processes
+# inherit them when they are forked (or get them once from the initializer where fork is not available).
+_chunks = None
+
+def set_chunks(chunks):
+    global _chunks
+    _chunks = chunks
+
+def frame_chunk(names, options, samplerate, index):
+    # Runs in a worker process. Returns frame() of chunk no. index, or None if the extractor fails on it.
+    try:
+        return frame(names, options, samplerate, _chunks[index])
+    except Exception:
+        return None
+
+def decode_bytes(names, options, samplerate, state, extractor_state, extracted):
+    # Runs in a worker process. Like decode_chunk(), but the output of the extractor is given (by frame()), so only
+    # 'packeter' decodes. extractor_state is the state of the extractor at the end of the chunk.
+    stack = Stack(names, options, samplerate)
+    stack.restore(state)
+    decode = stack.decoders[1].decode
+    ss, es, kinds, codes, values, rows = extracted
+    try:
+        for i in range(len(ss)):
+            decode(ss[i], es[i], [kinds[codes[i]], values[i], rows[i]])
+    except Exception:
+        return None
+    end_state = stack.snapshot()
+    end_state[0] = extractor_state
+    return stack.annotations, stack.python, end_state
+
+def decode_chunk(names, options, samplerate, index, state):
+    # Runs in a worker process. Returns the output of a stack started from the given state and its state at the
+    # end of chunk no. index, or None if the chunk cannot be decoded from that state.
+    stack = Stack(names, options, samplerate)
+    stack.restore(state)
+    try:
+        stack.run(_chunks[index])
+    except Exception:
+        return None
+    return stack.annotations, stack.python, stack.snapshot()
+
+def repair(names, options, samplerate, packets, carried, state, result, lockstep=4096):
+    # Decodes the chunk from the carried state until a stack started from the state of the worker gets into the
+    # same state, then takes the rest of the output from the worker result. Returns the annotations, the python
+    # output, the state at the end and whether the worker result was used.
+    # Once in the same state, the stacks stay in it, so the states are only compared after 1, 2, 4, 8, ... packets
+    # and the worker result is given up after lockstep packets.
+    stack = Stack(names, options, samplerate)
+    stack.restore(carried)
+    other = None
+    if result is not None:
+        other = Stack(names, options, samplerate)
+        other.restore(state)
+    check = 1
+    for i, (ss, es, data) in enumerate(packets):
+        stack.decode(ss, es, data)
+        if other is None:
+            continue
+        try:
+            other.decode(ss, es, data)
+        except Exception:
+            other = None
+            continue
+        if i + 1 == check:
+            if stack.same_state(other):
+                annotations, python, end_state = result
+                stack.annotations.extend(annotations, len(other.annotations))
+                stack.python.extend(python, len(other.python))
+                return stack.annotations, stack.python, end_state, True
+            check *= 2
+            if check > lockstep:
+                other = None
+    return stack.annotations, stack.python, stack.snapshot(), False
+
+def decode_parallel(packets, names, options=None, bus='uart', samplerate=None, workers=None, chunk_size=None,
+                    idle=1000, cs_polarity='active-low'):
+    # Returns the annotations and the python output of the whole stream, identical to those of a serial run
+    options = options or {}
+    for option in ('index-file', 'export-dir'):
+        if options.get('packeter', {}).get(option, 'none') != 'none':
+            # The chunks would be decoded in different processes, each of them writing its own files
+            raise ValueError('The %s option of packeter is not supported in parallel decoding.' % option)
+    if chunk_size is None:
+        chunk_size = max(10000, len(packets) // (4 * (workers or 8)))
+    chunks = split(packets, bus, chunk_size, idle, cs_polarity)
+    initial = Stack(names, options, samplerate).snapshot()
+
+    annotations = AnnotationStore()
+    python = PythonStore()
+    carried = initial
+    stack = None
+    if 'fork' in multiprocessing.get_all_start_methods():
+        set_chunks(chunks)
+        pool = ProcessPoolExecutor(workers, multiprocessing.get_context('fork'))
+    else:
+        pool = ProcessPoolExecutor(workers, initializer=set_chunks, initargs=(chunks,))
+    with pool:
+        if names == [EXTRACTORS.get(bus), 'packeter']:
+            # The workers run the extractor and summarize the framing of their chunks first, the states at the
+            # seams follow from the summaries of the chunks before them
+            frames = [pool.submit(frame_chunk, names, options, samplerate, i) for i in range(len(chunks))]
+            states = start_states(initial, (f.result() for f in frames), options)
+        else:
+            states = [(initial, None)] * len(chunks)
+        futures = []
+        for i, (state, framed) in enumerate(states):
+            if framed is None:
+                future = pool.submit(decode_chunk, names, options, samplerate, i, state)
+            else:
+                future = pool.submit(decode_bytes, names, options, samplerate, state, framed[2], framed[3])
+            futures.append((state, future))
+        for i, (chunk, (state, future)) in enumerate(zip(chunks, futures)):
+            result = future.result()
+            if result is None or carried != state:
+                result = repair(names, options, samplerate, chunk, carried, state, result)
+                if not result[3]:
+                    # The state of the workers does not get into the state of a serial run, so decoding the
+                    # rest in the workers would only decode it twice. Decode the rest serially in one pass.
+                    for _, f in futures[i + 1:]:
+                        f.cancel()
+                    annotations.extend(result[0])
+                    python.extend(result[1])
+                    stack = Stack(names, options, samplerate)
+                    stack.restore(result[2])
+                    for c in chunks[i + 1:]:
+                        stack.run(c)
+                    break
+            chunk_annotations, chunk_python, carried = result[:3]
+            annotations.extend(chunk_annotations)
+            python.extend(chunk_python)
+    set_chunks(None)
+    if stack is None:
+        # The output of the decoders at the end of the stream (e.g. the last interval of 'busstats'), from the state
+        # after the last chunk
+        stack = Stack(names, options, samplerate)
+        stack.restore(carried)
+    stack.end()
+    annotations.extend(stack.annotations)
+    python.extend(stack.python)
+    return annotations, python
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Decode a packet stream (JSONL) in parallel.')
+    parser.add_argument('input', help='packet stream in JSONL format')
+    parser.add_argument('-s', '--stack', required=True,
+                        help='comma separated decoder directories from bottom to top, e.g. extractor_i2c,packeter')
+    parser.add_argument('-o', '--option', action='append', help='decoder option as decoder:option=value')
+    parser.add_argument('--bus', required=True, choices=('uart', 'spi', 'i2c'), help='bus of the packet stream')
+    parser.add_argument('--samplerate', type=int, help='samplerate sent to the decoders as metadata')
+    parser.add_argument('-j', '--workers', type=int, help='number of worker processes (default: CPU count)')
+    parser.add_argument('--chunk-size', type=int, help='minimal number of packets in a chunk')
+    parser.add_argument('--idle', type=int, default=1000,
+                        help='UART gap in samples (between two packets) at which the stream may be split')
+    parser.add_argument('--cs-polarity', default='active-low', choices=('active-low', 'active-high'))
+    parser.add_argument('--json', action='store_true', help='print annotations as JSONL')
+    parser.add_argument('-q', '--quiet', action='store_true', help='print only the summary')
+    args = parser.parse_args(argv)
+
+    packets = list(read_packets(args.input))
+    start = time.perf_counter()
+    annotations, python = decode_parallel(packets, args.stack.split(','), parse_options(args.option), args.bus,
+                                          args.samplerate, args.workers, args.chunk_size, args.idle,
+                                          args.cs_polarity)
+    elapsed = time.perf_counter() - start
+
+    if not args.quiet:
+        # Only used for the names of the decoders and their annotation classes
+        stack = Stack(args.stack.split(','), parse_options(args.option), args.samplerate)
+        stack.annotations = annotations
+        print_annotations(stack, args.json)
+    print('%d annotations, %d python outputs in %.3f s' % (len(annotations), len(python), elapsed),
+          file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
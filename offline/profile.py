@@ -0,0 +1,159 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2022 Matej Martinček <matomarss@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+'''
+Opt-in profiling of the decoders run by the harness.
+
+Profiling of a stack is enabled by the profile_path argument of Stack, the path of a report file ('-' for stderr).
+The command line tools decoding a single stack (replay and the front-ends) take it from their --profile option or the
+PD_PROFILE environment variable. The benchmark, the golden check and the parallel decoding never profile, so that the
+environment variable does not distort their timing. For every decoder of the stack it records:
+
+- the time of importing its module, of constructing the instance, of metadata() and of start()
+- the number of decode() and put() calls, their cumulative time and a histogram of the time per call
+  (decode() includes the put() calls it makes and put() of OUTPUT_PYTHON includes the decoders above)
+- the number of annotations put per annotation class
+
+The report is appended to the file when Stack.end() is called, as text or, for a .jsonl path, as one JSON line.
+When profiling is disabled, the decoder classes are used as they are, so there is no overhead.
+'''
+
+import json
+import os
+import sys
+import time
+
+ENV = 'PD_PROFILE'
+
+# Calls are counted in bins by the number of bits of their time in ns (bin k holds calls shorter than 2^k ns)
+BINS = 40
+
+class CallStats:
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.histogram = [0] * BINS
+
+    def add(self, ns):
+        self.count += 1
+        self.total += ns
+        self.histogram[min(ns.bit_length(), BINS - 1)] += 1
+
+    def percentile(self, p):
+        # Upper bound of the time (in ns) which p percent of the calls do not exceed
+        count = 0
+        for k, n in enumerate(self.histogram):
+            count += n
+            if count * 100 >= self.count * p:
+                return (1 << k) - 1
+        return (1 << (BINS - 1)) - 1
+
+    def as_dict(self):
+        return {'count': self.count, 'total_ns': self.total, 'histogram': self.histogram}
+
+class DecoderProfile:
+    def __init__(self, name):
+        self.name = name
+        self.times = {}
+        self.decode = CallStats()
+        self.put = CallStats()
+        self.outputs = {}
+        self.annotations = {}
+
+class Profiler:
+    def __init__(self, path):
+        self.path = path
+        self.decoders = []
+
+    def timed(self, profile, what, function, *args):
+        # Calls the function and records its time under the given name
+        start = time.perf_counter_ns()
+        result = function(*args)
+        profile.times[what] = profile.times.get(what, 0) + time.perf_counter_ns() - start
+        return result
+
+    def load(self, name, load_decoder):
+        # Returns a subclass of the decoder class recording the calls of decode(), put() and register()
+        profile = DecoderProfile(name)
+        self.decoders.append(profile)
+        imported = name in sys.modules
+        cls = self.timed(profile, 'import', load_decoder, name)
+        if imported:
+            # Imported by an earlier stack, only the lookup was timed
+            profile.times['import'] = 0
+        perf_counter_ns = time.perf_counter_ns
+        decode_stats = profile.decode
+        put_stats = profile.put
+        outputs = profile.outputs
+        annotations = profile.annotations
+
+        def decode(d, ss, es, data):
+            start = perf_counter_ns()
+            cls.decode(d, ss, es, data)
+            decode_stats.add(perf_counter_ns() - start)
+
+        def put(d, ss, es, output_id, data):
+            start = perf_counter_ns()
+            cls.put(d, ss, es, output_id, data)
+            put_stats.add(perf_counter_ns() - start)
+            if outputs[output_id] == 'annotation':
+                annotations[data[0]] = annotations.get(data[0], 0) + 1
+
+        def register(d, output_type, proto_id=None, meta=None):
+            output_id = cls.register(d, output_type, proto_id, meta)
+            outputs[output_id] = ('annotation', 'python', 'binary', 'logic', 'meta')[output_type]
+            return output_id
+
+        return type(cls.__name__, (cls,), {'decode': decode, 'put': put, 'register': register})
+
+    def report(self, stack):
+        if self.path.endswith('.jsonl'):
+            text = json.dumps({'decoders': [{
+                'name': p.name,
+                'times_ns': p.times,
+                'decode': p.decode.as_dict(),
+                'put': p.put.as_dict(),
+                'annotations': {stack.annotation_id(i, cls): n for cls, n in sorted(p.annotations.items())},
+            } for i, p in enumerate(self.decoders)]}) + '\n'
+        else:
+            lines = []
+            for i, p in enumerate(self.decoders):
+                lines.append('%s: %s' % (p.name, ', '.join('%s %.3f ms' % (what, ns / 1e6)
+                                                             for what, ns in p.times.items())))
+                for what, stats in (('decode', p.decode), ('put', p.put)):
+                    if stats.count:
+                        lines.append('  %-6s %9d calls %10.3f ms  mean %7.0f ns  median <= %d ns  99%% <= %d ns'
+                                     % (what, stats.count, stats.total / 1e6, stats.total / stats.count,
+                                        stats.percentile(50), stats.percentile(99)))
+                for cls, n in sorted(p.annotations.items()):
+                    lines.append('  %-20s %9d annotations' % (stack.annotation_id(i, cls), n))
+            text = '\n'.join(lines) + '\n'
+        if self.path == '-':
+            sys.stderr.write(text)
+        else:
+            with open(self.path, 'a') as f:
+                f.write(text)
+
+def profiler(path=None):
+    # Returns a Profiler writing to the path, or None if no path is given
+    return Profiler(path) if path else None
+
+def command_line_path(option):
+    # The report path of a command line tool: its --profile option, otherwise the environment variable
+    return option or os.environ.get(ENV)
@@ -0,0 +1,78 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2022 Matej Martinček <matomarss@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+'''
+Replays a recorded packet stream through a decoder stack and prints the annotations.
+
+Example:
+python -m offline.replay -s extractor_uart,packeter -o packeter:output-format=hex uart.jsonl
+'''
+
+import argparse
+import json
+import sys
+import time
+
+from . import profile
+from .harness import Stack, read_packets
+
+def parse_options(values):
+    # Turns ['packeter:output-format=hex', ...] into {'packeter': {'output-format': 'hex'}, ...}
+    options = {}
+    for v in values or []:
+        name, _, option = v.partition(':')
+        key, sep, value = option.partition('=')
+        if not sep:
+            raise ValueError('Option %r is not in the form decoder:option=value.' % v)
+        options.setdefault(name, {})[key] = value
+    return options
+
+def print_annotations(stack, as_json=False):
+    for ss, es, d, cls, texts in stack.annotations:
+        if as_json:
+            print(json.dumps([ss, es, stack.names[d], stack.annotation_id(d, cls), list(texts)], ensure_ascii=False))
+        else:
+            print('%d-%d %s: %s: "%s"' % (ss, es, stack.names[d], stack.annotation_id(d, cls), texts[0]))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Replay a packet stream (JSONL) through a decoder stack.')
+    parser.add_argument('input', help='packet stream in JSONL format')
+    parser.add_argument('-s', '--stack', required=True,
+                        help='comma separated decoder directories from bottom to top, e.g. extractor_uart,packeter')
+    parser.add_argument('-o', '--option', action='append', help='decoder option as decoder:option=value')
+    parser.add_argument('--samplerate', type=int, help='samplerate sent to the decoders as metadata')
+    parser.add_argument('--json', action='store_true', help='print annotations as JSONL')
+    parser.add_argument('-q', '--quiet', action='store_true', help='print only the summary')
+    parser.add_argument('--profile', help='profile the decoders and append the report to this file (- for stderr)')
+    args = parser.parse_args(argv)
+
+    stack = Stack(args.stack.split(','), parse_options(args.option), args.samplerate,
+                  profile.command_line_path(args.profile))
+    start = time.perf_counter()
+    stack.run(read_packets(args.input))
+    stack.end()
+    elapsed = time.perf_counter() - start
+
+    if not args.quiet:
+        print_annotations(stack, args.json)
+    print('%d annotations, %d python outputs in %.3f s' % (len(stack.annotations), len(stack.python), elapsed),
+          file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2022 Matej Martinček <matomarss@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+'''
+Access to packed logic samples for the NumPy front-ends.
+
+Packed logic samples are what sigrok stores: one unsigned integer of 'unitsize' bytes per sample, where bit n holds
+the state of channel n. They are read from a raw file (memory-mapped) or from the logic-1-<n> chunks of a .sr session.
+Large arrays are processed in windows of a fixed number of samples, so that memory use does not grow with the capture.
+'''
+
+import configparser
+import re
+import zipfile
+
+import numpy as np
+
+DTYPES = {1: '<u1', 2: '<u2', 4: '<u4', 8: '<u8'}
+
+def dtype(unitsize):
+    if unitsize not in DTYPES:
+        raise ValueError('Unsupported unitsize %d.' % unitsize)
+    return np.dtype(DTYPES[unitsize])
+
+def map_raw(path, unitsize=1):
+    # Memory-maps a raw file of packed samples
+    return np.memmap(path, dtype=dtype(unitsize), mode='r')
+
+def session_metadata(path):
+    # Samplerate, unitsize and channel names of the first device of a .sr session
+    with zipfile.ZipFile(path) as z:
+        config = configparser.ConfigParser()
+        config.read_string(z.read('metadata').decode())
+    device = config['device 1']
+    channels = {}
+    for key, name in device.items():
+        m = re.match(r'probe(\d+)$', key)
+        if m:
+            channels[name] = int(m.group(1)) - 1
+    return {
+        'samplerate': parse_samplerate(device.get('samplerate', '0')),
+        'unitsize': int(device.get('unitsize', '1')),
+        'channels': channels,
+        'capturefile': device.get('capturefile', 'logic-1'),
+    }
+
+def parse_samplerate(s):
+    # '1 MHz', '500 kHz', '24000000' -> samples per second
+    m = re.match(r'\s*([\d.]+)\s*([kMG]?)Hz\s*$', s)
+    if not m:
+        return int(s)
+    return int(float(m.group(1)) * {'': 1, 'k': 10**3, 'M': 10**6, 'G': 10**9}[m.group(2)])
+
+def session_chunks(path):
+    # Yields the packed sample arrays of all chunks of a .sr session in order. The chunks are stored compressed
+    # in the zip file, so every chunk is read into memory (one at a time).
+    meta = session_metadata(path)
+    with zipfile.ZipFile(path) as z:
+        names = [n for n in z.namelist() if re.match(re.escape(meta['capturefile']) + r'-\d+$', n)]
+        names.sort(key=lambda n: int(n.rsplit('-', 1)[1]))
+        for name in names:
+            yield np.frombuffer(z.read(name), dtype=dtype(meta['unitsize']))
+
+def open_capture(path, samplerate=None, unitsize=1, window=1 << 24):
+    # Samplerate and an iterator of windows of packed samples of a .sr session or a raw file
+    if zipfile.is_zipfile(path):
+        meta = session_metadata(path)
+        samplerate = samplerate or meta['samplerate']
+        chunks = (w for chunk in session_chunks(path) for w in windows(chunk, window))
+    else:
+        chunks = windows(map_raw(path, unitsize), window)
+    if not samplerate:
+        raise ValueError('The samplerate of the capture is not known.')
+    return samplerate, chunks
+
+def windows(samples, size=1 << 24):
+    # Yields consecutive windows of an array (e.g. a memory map) without copying it
+    for start in range(0, len(samples), size):
+        yield samples[start:start + size]
+
+def channel(samples, index, invert=False):
+    # 0/1 states of a channel as uint8
+    line = ((samples >> index) & 1).astype(np.uint8)
+    if invert:
+        line ^= 1
+    return line
+
+def falling_edges(line):
+    # Indices of the samples at which the line goes from 1 to 0
+    return np.flatnonzero(line[1:] < line[:-1]) + 1
+
+def rising_edges(line):
+    return np.flatnonzero(line[1:] > line[:-1]) + 1
+
+def runs(ids):
+    # For a non-decreasing array of group ids, the rank of every element within its group and the size of its group
+    n = len(ids)
+    if n == 0:
+        return np.zeros(0, np.int64), np.zeros(0, np.int64)
+    starts = np.flatnonzero(np.concatenate(([True], ids[1:] != ids[:-1])))
+    lengths = np.diff(np.append(starts, n))
+    rank = np.arange(n) - np.repeat(starts, lengths)
+    return rank, np.repeat(lengths, lengths)
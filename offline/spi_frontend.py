@@ -0,0 +1,181 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2022 Matej Martinček <matomarss@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+'''
+Vectorized SPI front-end replacing the 'spi' PD for offline decoding of large captures.
+
+The sampling clock edges (depending on CPOL/CPHA) are found with NumPy edge detection, the edges while CS# is not
+active are dropped and the MOSI/MISO bits at the remaining edges are gathered into words per CS# assertion, all in
+vectorized operations. The result is the packet stream of the 'spi' PD:
+
+['CS-CHANGE', <old cs>, <new cs>]       (['CS-CHANGE', None, None] at the start if there is no CS# channel)
+['BITS', <mosi bits>, <miso bits>]      (only if bits is True)
+['DATA', <mosi>, <miso>]
+
+which 'extractor_spi' consumes. Like in the 'spi' PD, an incomplete word is dropped when CS# is deasserted, the bit
+lists are [<bit>, <ss>, <es>] in reverse order of reception and the value of a missing MOSI/MISO channel is None.
+The 'TRANSFER' packets of the 'spi' PD are not generated.
+'''
+
+import argparse
+
+import numpy as np
+
+from . import profile
+from .harness import Stack, write_packets
+from .replay import parse_options, print_annotations
+from .samples import channel, falling_edges, open_capture, rising_edges, runs
+
+class SpiFrontend:
+    def __init__(self, clk, mosi=None, miso=None, cs=None, cpol=0, cpha=0, bitorder='msb-first', wordsize=8,
+                 cs_polarity='active-low', bits=True):
+        if mosi is None and miso is None:
+            raise ValueError('At least one of the mosi and miso channels is needed.')
+        self.clk, self.mosi, self.miso, self.cs = clk, mosi, miso, cs
+        # Modes 0 and 3 sample data on the rising clock edge, modes 1 and 2 on the falling one
+        self.sample_edges = rising_edges if cpol == cpha else falling_edges
+        self.wordsize = wordsize
+        self.cs_active = 0 if cs_polarity == 'active-low' else 1
+        self.bits = bits
+        self.weights = np.left_shift(1, np.arange(wordsize, dtype=np.int64))
+        if bitorder == 'msb-first':
+            self.weights = self.weights[::-1].copy()
+
+        # The last sample of the previous window (for edge detection across windows) and its sample number
+        self.prev = None
+        self.base = 0
+        # Sample numbers and MOSI/MISO bits of the edges of the word not completed in the previous window
+        self.pending = (np.zeros(0, np.int64), np.zeros(0, np.uint8), np.zeros(0, np.uint8))
+
+    def feed(self, samples):
+        # Returns the packets of all words completed and all CS# changes in this window of packed samples
+        if self.prev is None:
+            buf = samples
+            events = [(0, (0, 0, ['CS-CHANGE', None, None]))] if self.cs is None else []
+        else:
+            buf = np.concatenate((self.prev, samples))
+            events = []
+        base = self.base
+
+        edges = self.sample_edges(channel(buf, self.clk))
+        changes = np.zeros(0, np.int64)
+        open_end = True
+        if self.cs is not None:
+            cs = channel(buf, self.cs)
+            if self.prev is None:
+                events.append((0, (0, 0, ['CS-CHANGE', None, int(cs[0])])))
+            changes = np.flatnonzero(cs[1:] != cs[:-1]) + 1
+            for pos, new in zip((changes + base).tolist(), cs[changes].tolist()):
+                events.append((pos, (pos, pos, ['CS-CHANGE', 1 - new, new])))
+            edges = edges[cs[edges] == self.cs_active]
+            open_end = cs[-1] == self.cs_active
+
+        # The edges of the incomplete word of the previous window come first and belong to the first CS# assertion
+        positions = np.concatenate((self.pending[0], edges + base))
+        mosi = np.concatenate((self.pending[1], channel(buf[edges], self.mosi) if self.mosi is not None
+                               else np.zeros(len(edges), np.uint8)))
+        miso = np.concatenate((self.pending[2], channel(buf[edges], self.miso) if self.miso is not None
+                               else np.zeros(len(edges), np.uint8)))
+        assertion = np.searchsorted(changes + base, positions, side='right')
+        rank, size = runs(assertion)
+        complete = rank < size // self.wordsize * self.wordsize
+        if open_end:
+            # The rest of the last assertion may still get completed in the next window
+            rest = ~complete & (assertion == len(changes))
+            self.pending = (positions[rest], mosi[rest], miso[rest])
+        else:
+            self.pending = (np.zeros(0, np.int64), np.zeros(0, np.uint8), np.zeros(0, np.uint8))
+
+        events += self.words(positions[complete].reshape(-1, self.wordsize),
+                             mosi[complete].reshape(-1, self.wordsize), miso[complete].reshape(-1, self.wordsize))
+        events.sort(key=lambda e: e[0])
+
+        self.prev = buf[-1:]
+        self.base = base + len(buf) - 1
+        return [p for _, p in events]
+
+    def words(self, positions, mosi, miso):
+        # (sample at which the 'spi' PD puts them, packet) of the packets of all words
+        if len(positions) == 0:
+            return []
+        # Every bit lasts until the next edge, the last one as long as the one before it
+        width = positions[:, -1] - positions[:, -2] if self.wordsize > 1 else np.ones(len(positions), np.int64)
+        ends = np.concatenate((positions[:, 1:], (positions[:, -1] + width)[:, None]), axis=1)
+        ss = positions[:, 0].tolist()
+        es = ends[:, -1].tolist()
+        put_at = positions[:, -1].tolist()
+        mosi_values = (mosi @ self.weights).tolist() if self.mosi is not None else [None] * len(ss)
+        miso_values = (miso @ self.weights).tolist() if self.miso is not None else [None] * len(ss)
+
+        events = []
+        if self.bits:
+            bit_ss = positions[:, ::-1].tolist()
+            bit_es = ends[:, ::-1].tolist()
+            mosi_bits = mosi[:, ::-1].tolist()
+            miso_bits = miso[:, ::-1].tolist()
+            for i in range(len(ss)):
+                b_mosi = [list(b) for b in zip(mosi_bits[i], bit_ss[i], bit_es[i])] if self.mosi is not None \
+                    else None
+                b_miso = [list(b) for b in zip(miso_bits[i], bit_ss[i], bit_es[i])] if self.miso is not None \
+                    else None
+                events.append((put_at[i], (ss[i], es[i], ['BITS', b_mosi, b_miso])))
+                events.append((put_at[i], (ss[i], es[i], ['DATA', mosi_values[i], miso_values[i]])))
+        else:
+            for i in range(len(ss)):
+                events.append((put_at[i], (ss[i], es[i], ['DATA', mosi_values[i], miso_values[i]])))
+        return events
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Decode SPI from a raw or .sr capture and run a decoder stack.')
+    parser.add_argument('capture', help='.sr session or raw file of packed samples')
+    parser.add_argument('--samplerate', type=int, help='samplerate (taken from the metadata of .sr sessions)')
+    parser.add_argument('--unitsize', type=int, default=1, help='bytes per sample of a raw file')
+    parser.add_argument('--clk', type=int, required=True, help='channel index of CLK')
+    parser.add_argument('--mosi', type=int, help='channel index of MOSI')
+    parser.add_argument('--miso', type=int, help='channel index of MISO')
+    parser.add_argument('--cs', type=int, help='channel index of CS#')
+    parser.add_argument('--cpol', type=int, default=0, choices=(0, 1))
+    parser.add_argument('--cpha', type=int, default=0, choices=(0, 1))
+    parser.add_argument('--bitorder', default='msb-first', choices=('msb-first', 'lsb-first'))
+    parser.add_argument('--wordsize', type=int, default=8)
+    parser.add_argument('--cs-polarity', default='active-low', choices=('active-low', 'active-high'))
+    parser.add_argument('-s', '--stack', default='extractor_spi,packeter',
+                        help='comma separated decoder directories stacked on top of the front-end')
+    parser.add_argument('-o', '--option', action='append', help='decoder option as decoder:option=value')
+    parser.add_argument('--write', help='write the SPI packet stream to this JSONL file instead of decoding it')
+    parser.add_argument('--json', action='store_true', help='print annotations as JSONL')
+    parser.add_argument('--profile', help='profile the decoders and append the report to this file (- for stderr)')
+    args = parser.parse_args(argv)
+
+    samplerate, chunks = open_capture(args.capture, args.samplerate, args.unitsize)
+    frontend = SpiFrontend(args.clk, args.mosi, args.miso, args.cs, args.cpol, args.cpha, args.bitorder,
+                           args.wordsize, args.cs_polarity, bits=bool(args.write))
+    if args.write:
+        write_packets(args.write, (p for chunk in chunks for p in frontend.feed(chunk)))
+        return
+
+    stack = Stack(args.stack.split(','), parse_options(args.option), samplerate,
+                  profile.command_line_path(args.profile))
+    for chunk in chunks:
+        stack.run(frontend.feed(chunk))
+    stack.end()
+    print_annotations(stack, args.json)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2022 Matej Martinček <matomarss@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+'''
+Pure-Python stand-in for the 'sigrokdecode' module of libsigrokdecode.
+
+Only the part of the API used by stacked decoders is provided: the output type constants, SRD_CONF_SAMPLERATE and
+the Decoder base class with register() and put(). The harness installs this module as 'sigrokdecode' and takes
+care of setting up 'options', delivering metadata and routing the outputs of every instance.
+'''
+
+OUTPUT_ANN = 0
+OUTPUT_PYTHON = 1
+OUTPUT_BINARY = 2
+OUTPUT_LOGIC = 3
+OUTPUT_META = 4
+
+SRD_CONF_SAMPLERATE = 10000
+
+class Decoder(object):
+    api_version = 3
+    options = ()
+    annotations = ()
+    annotation_rows = ()
+
+    # Set up by the harness before start() is called
+    _session = None
+    _routes = None
+
+    def register(self, output_type, proto_id=None, meta=None):
+        # Like in libsigrokdecode, the returned output id is just an index local to this instance
+        if self._session is None:
+            raise RuntimeError('Decoder instance is not attached to a session.')
+        self._routes.append(self._session.route(self, output_type, proto_id, meta))
+        return len(self._routes) - 1
+
+    def put(self, ss, es, output_id, data):
+        self._routes[output_id](ss, es, data)
@@ -0,0 +1,48 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2022 Matej Martinček <matomarss@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+'''
+Stand-in for 'common.srdhelper' of libsigrokdecode, limited to the helpers used by the decoders in this repository.
+'''
+
+import re
+from enum import IntEnum
+
+def bcd2int(b):
+    return (b & 0x0f) + ((b >> 4) * 10)
+
+class SrdIntEnum(IntEnum):
+    @classmethod
+    def _prefix(cls, p):
+        return tuple([a.value for a in cls if a.name.startswith(p)])
+
+    @classmethod
+    def prefixes(cls, prefix_list):
+        if isinstance(prefix_list, str):
+            prefix_list = prefix_list.split()
+        return tuple([v for p in prefix_list for v in cls._prefix(p)])
+
+    @classmethod
+    def from_list(cls, name, l):
+        # Keys are limited/converted to [A-Z0-9_], values are zero-based.
+        return cls(name, [(re.sub('[^A-Z0-9_]', '_', l[i].upper()), i) for i in range(len(l))])
+
+    @classmethod
+    def from_str(cls, name, s):
+        return cls.from_list(name, s.split())
@@ -0,0 +1,257 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2022 Matej Martinček <matomarss@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+'''
+Vectorized UART front-end replacing the 'uart' PD for offline decoding of large captures.
+
+Start bits are found with NumPy edge detection and all bits of all frames are sampled at once, like the 'uart' PD
+samples them (at sample_point percent of every bit). The result is the packet stream of the 'uart' PD:
+
+['STARTBIT', <rxtx>, 0]
+['DATA', <rxtx>, (<value>, [[<bit>, <ss>, <es>], ...])]
+['PARITYBIT', <rxtx>, <bit>]            (only if parity is used)
+['STOPBIT', <rxtx>, <bit>]
+
+in the order in which the 'uart' PD puts them, so that 'extractor_uart' and the decoders above it run on top of it
+unchanged. Only the first stop bit is sampled and frames which are not complete at the end of the capture are
+dropped. If bits is False, the list of data bits in the DATA packets is left empty, which saves time when the decoders
+above do not use it (the extractor does not).
+
+Example (RX on channel 0, TX on channel 1 of a raw capture with unitsize 1):
+
+frontend = UartFrontend(samplerate=10000000, baudrate=115200, rx=0, tx=1)
+stack = Stack(['extractor_uart', 'packeter'])
+for window in windows(map_raw('capture.raw')):
+    stack.run(frontend.feed(window))
+stack.run(frontend.end())
+'''
+
+import argparse
+from math import ceil, floor
+
+import numpy as np
+
+from . import profile
+from .harness import Stack, write_packets
+from .replay import parse_options, print_annotations
+from .samples import channel, falling_edges, open_capture
+
+RX = 0
+TX = 1
+
+class UartFrontend:
+    def __init__(self, samplerate, baudrate=115200, rx=None, tx=None, num_data_bits=8, parity='none',
+                 bit_order='lsb-first', invert_rx=False, invert_tx=False, sample_point=50, bits=True):
+        if rx is None and tx is None:
+            raise ValueError('At least one of the rx and tx channels is needed.')
+        if parity not in ('none', 'odd', 'even', 'zero', 'one'):
+            raise ValueError('Invalid parity %r.' % parity)
+        self.bit_width = float(samplerate) / float(baudrate)
+        self.num_data_bits = num_data_bits
+        self.parity = parity != 'none'
+        self.bits = bits
+
+        # Offsets of the sample points of the start bit, data bits, parity bit and stop bit from the falling edge
+        # of the start bit, computed the same way as the sample points of the 'uart' PD (it waits for the sample
+        # ceil(get_sample_point()))
+        frame_bits = 1 + num_data_bits + self.parity + 1
+        position = (self.bit_width - 1) * (sample_point / 100.0) + np.arange(frame_bits) * self.bit_width
+        self.offsets = np.ceil(position).astype(np.int64)
+        self.span = int(self.offsets[-1]) + 1
+
+        self.weights = np.left_shift(1, np.arange(num_data_bits, dtype=np.int64))
+        if bit_order == 'msb-first':
+            self.weights = self.weights[::-1].copy()
+
+        self.channels = []
+        if rx is not None:
+            self.channels.append((RX, rx, invert_rx))
+        if tx is not None:
+            self.channels.append((TX, tx, invert_tx))
+
+        # Samples not processed yet (from the previous call of feed()) and the sample number of the first of them
+        self.tail = None
+        self.base = 0
+        # For each of RX/TX, the next start bit has to start after this sample (the last sampled stop bit)
+        self.last_stop = [-1, -1]
+        # Packets which may still be preceded by packets of frames starting in the next window and their order keys
+        # (twice the sample at which the 'uart' PD would put them plus rxtx)
+        self.pending = []
+        self.pending_at = []
+
+    def frames(self, line, cut, last_stop):
+        # Start samples (relative to line) of the frames starting before cut, chosen like the 'uart' PD does:
+        # the first falling edge with a low start bit after the previous stop bit
+        starts = falling_edges(line)
+        starts = starts[(starts > last_stop) & (starts < cut)]
+        starts = starts[line[starts + self.offsets[0]] == 0]
+        if len(starts) == 0:
+            return starts
+        following = np.searchsorted(starts, starts + self.offsets[-1], side='right').tolist()
+        chosen = []
+        i = 0
+        n = len(starts)
+        while i < n:
+            chosen.append(i)
+            i = following[i]
+        return starts[chosen]
+
+    def feed(self, samples):
+        # Returns the packets of all frames completed by this window of packed samples
+        buf = samples if self.tail is None else np.concatenate((self.tail, samples))
+        # Frames starting before cut lie completely in buf
+        cut = len(buf) - self.span + 1
+        if cut <= 1:
+            self.tail = buf
+            return []
+
+        found = []
+        for rxtx, index, invert in self.channels:
+            line = channel(buf, index, invert)
+            starts = self.frames(line, cut, self.last_stop[rxtx] - self.base)
+            if len(starts) == 0:
+                continue
+            self.last_stop[rxtx] = self.base + int(starts[-1] + self.offsets[-1])
+            sampled = line[starts[:, None] + self.offsets]
+            values = sampled[:, 1:1 + self.num_data_bits] @ self.weights
+            found.append((starts + self.base, np.full(len(starts), rxtx), values, sampled))
+
+        packets = self.packets(found, self.base + cut)
+        self.base += cut - 1
+        self.tail = buf[cut - 1:]
+        return packets
+
+    def end(self):
+        # Returns the packets held back by feed() at the end of the capture
+        packets = self.pending
+        self.pending = []
+        self.pending_at = []
+        return packets
+
+    def packets(self, found, cut):
+        # Packets of the frames of all channels in the order in which the 'uart' PD puts them (when it samples
+        # their last bit)
+        packets = []
+        emitted = []
+        if found:
+            starts = np.concatenate([f[0] for f in found])
+            order = np.argsort(starts, kind='stable')
+            starts = starts[order]
+            rxtxs = np.concatenate([f[1] for f in found])[order]
+            values = np.concatenate([f[2] for f in found])[order].tolist()
+            sampled = np.concatenate([f[3] for f in found])[order]
+
+            # Like the 'uart' PD, the packets span floor(half a bit) before and ceil(half a bit) after the sample
+            # points, the data bits int(half a bit) on both sides
+            n = self.num_data_bits
+            hb = floor(self.bit_width / 2.0)
+            he = ceil(self.bit_width / 2.0)
+            points = starts[:, None] + self.offsets
+            if len(self.channels) > 1:
+                put_at = [0, n, n + 1, len(self.offsets) - 1] if self.parity else [0, n, len(self.offsets) - 1]
+                # At the same sample, the PD handles RX before TX
+                emitted = (points[:, put_at] * 2 + rxtxs[:, None]).ravel().tolist()
+            rxtxs = rxtxs.tolist()
+
+            start_ss = (points[:, 0] - hb).tolist()
+            start_es = (points[:, 0] + he).tolist()
+            data_ss = (points[:, 1] - hb).tolist()
+            data_es = (points[:, n] + he).tolist()
+            stop_ss = (points[:, -1] - hb).tolist()
+            stop_es = (points[:, -1] + he).tolist()
+            stop = sampled[:, -1].tolist()
+            if self.bits:
+                bits = [[list(b) for b in zip(*frame)] for frame in zip(
+                    sampled[:, 1:n + 1].tolist(), (points[:, 1:n + 1] - hb).tolist(),
+                    (points[:, 1:n + 1] + hb).tolist())]
+            else:
+                # The decoders above never modify the packets, so all frames can share the empty list
+                bits = [[]] * len(rxtxs)
+            if self.parity:
+                parity_ss = (points[:, n + 1] - hb).tolist()
+                parity_es = (points[:, n + 1] + he).tolist()
+                parity = sampled[:, n + 1].tolist()
+
+            for i in range(len(rxtxs)):
+                rxtx = rxtxs[i]
+                packets.append((start_ss[i], start_es[i], ['STARTBIT', rxtx, 0]))
+                packets.append((data_ss[i], data_es[i], ['DATA', rxtx, (values[i], bits[i])]))
+                if self.parity:
+                    packets.append((parity_ss[i], parity_es[i], ['PARITYBIT', rxtx, parity[i]]))
+                packets.append((stop_ss[i], stop_es[i], ['STOPBIT', rxtx, stop[i]]))
+
+        if len(self.channels) == 1:
+            return packets
+
+        # The packets of RX and TX frames overlapping in time are interleaved, ordered by twice the sample at which
+        # the PD puts them plus rxtx. Packets which might have to follow packets of a frame starting at cut or later
+        # are held back.
+        at = np.array(self.pending_at + emitted, dtype=np.int64)
+        order = np.argsort(at, kind='stable')
+        ready = int(np.searchsorted(at[order], 2 * (cut + self.offsets[0])))
+        packets = self.pending + packets
+        order = order.tolist()
+        self.pending = [packets[i] for i in order[ready:]]
+        self.pending_at = at[order[ready:]].tolist()
+        return [packets[i] for i in order[:ready]]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Decode UART from a raw or .sr capture and run a decoder stack.')
+    parser.add_argument('capture', help='.sr session or raw file of packed samples')
+    parser.add_argument('--samplerate', type=int, help='samplerate (taken from the metadata of .sr sessions)')
+    parser.add_argument('--unitsize', type=int, default=1, help='bytes per sample of a raw file')
+    parser.add_argument('--rx', type=int, help='channel index of RX')
+    parser.add_argument('--tx', type=int, help='channel index of TX')
+    parser.add_argument('--baudrate', type=int, default=115200)
+    parser.add_argument('--num-data-bits', type=int, default=8)
+    parser.add_argument('--parity', default='none', choices=('none', 'odd', 'even', 'zero', 'one'))
+    parser.add_argument('--bit-order', default='lsb-first', choices=('lsb-first', 'msb-first'))
+    parser.add_argument('--invert-rx', action='store_true')
+    parser.add_argument('--invert-tx', action='store_true')
+    parser.add_argument('-s', '--stack', default='extractor_uart,packeter',
+                        help='comma separated decoder directories stacked on top of the front-end')
+    parser.add_argument('-o', '--option', action='append', help='decoder option as decoder:option=value')
+    parser.add_argument('--write', help='write the UART packet stream to this JSONL file instead of decoding it')
+    parser.add_argument('--json', action='store_true', help='print annotations as JSONL')
+    parser.add_argument('--profile', help='profile the decoders and append the report to this file (- for stderr)')
+    args = parser.parse_args(argv)
+
+    samplerate, chunks = open_capture(args.capture, args.samplerate, args.unitsize)
+    frontend = UartFrontend(samplerate, args.baudrate, args.rx, args.tx, args.num_data_bits, args.parity,
+                            args.bit_order, args.invert_rx, args.invert_tx, bits=bool(args.write))
+    if args.write:
+        def packets():
+            for chunk in chunks:
+                for p in frontend.feed(chunk):
+                    yield p
+            for p in frontend.end():
+                yield p
+        write_packets(args.write, packets())
+        return
+
+    stack = Stack(args.stack.split(','), parse_options(args.option), samplerate,
+                  profile.command_line_path(args.profile))
+    for chunk in chunks:
+        stack.run(frontend.feed(chunk))
+    stack.run(frontend.end())
+    stack.end()
+    print_annotations(stack, args.json)
+
+if __name__ == '__main__':
+    main()
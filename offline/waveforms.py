@@ -0,0 +1,167 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2022 Matej Martinček <matomarss@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+'''
+Seeded synthesizers of logic captures (packed samples, one byte per sample) for checking the NumPy front-ends.
+
+Every synthesizer returns the samples as a NumPy array of uint8, where bit n is the state of channel n, and the values
+it has sent. The captures are built from segments of constant state, so bit lengths which are not a whole number of
+samples are rounded at every bit boundary like a real capture would round them.
+'''
+
+import random
+
+import numpy as np
+
+def _samples(segments):
+    # Packed samples from a list of (state, length) segments
+    states, lengths = zip(*segments)
+    return np.repeat(np.array(states, np.uint8), lengths)
+
+def _uart_line(rng, count, bit_width, idle):
+    # Levels and lengths of 8N1 frames of random bytes separated by random idle gaps, and the bytes
+    segments = [(1, idle)]
+    values = []
+    position = 0.0
+    for _ in range(count):
+        b = rng.randrange(256)
+        values.append(b)
+        levels = [0] + [(b >> i) & 1 for i in range(8)] + [1]
+        for level in levels:
+            start = round(position)
+            position += bit_width
+            segments.append((level, round(position) - start))
+        gap = rng.choice((0, 0, rng.randint(1, 3 * idle)))
+        segments.append((1, gap))
+        position += gap
+    segments.append((1, idle))
+    return [s for s in segments if s[1] > 0], values
+
+def uart_capture(seed=0, count=64, samplerate=1000000, baudrate=115200, idle=50):
+    # RX on channel 0 and TX on channel 1, both sending count bytes independently of each other.
+    # Returns the samples and the bytes sent on RX and TX.
+    rng = random.Random(seed)
+    bit_width = samplerate / baudrate
+    lines = []
+    values = []
+    for _ in range(2):
+        segments, v = _uart_line(rng, count, bit_width, idle)
+        lines.append(_samples(segments))
+        values.append(v)
+    n = max(len(l) for l in lines)
+    rx, tx = [np.concatenate((l, np.ones(n - len(l), np.uint8))) for l in lines]
+    return rx | (tx << 1), values
+
+def spi_capture(seed=0, count=40, half_period=3, idle=20):
+    # SPI mode 0, MSB first, 8-bit words: CLK on channel 0, MOSI on 1, MISO on 2 and CS# (active low) on 3.
+    # Transfers of 1 to 6 words, some of them ending with an incomplete word, which is not decoded.
+    # Returns the samples and the complete words sent on MOSI and MISO.
+    rng = random.Random(seed)
+
+    def state(clk, mosi, miso, cs):
+        return clk | (mosi << 1) | (miso << 2) | (cs << 3)
+
+    segments = [(state(0, 0, 0, 1), idle)]
+    values = [[], []]
+    for _ in range(count):
+        segments.append((state(0, 0, 0, 0), rng.randint(1, 2 * half_period)))
+        words = rng.randint(1, 6)
+        partial = rng.choice((0, 0, rng.randint(1, 7)))
+        for w in range(words + bool(partial)):
+            mosi, miso = rng.randrange(256), rng.randrange(256)
+            bits = 8
+            if w == words:
+                bits = partial
+            else:
+                values[0].append(mosi)
+                values[1].append(miso)
+            for i in range(7, 7 - bits, -1):
+                m, s = (mosi >> i) & 1, (miso >> i) & 1
+                segments.append((state(0, m, s, 0), half_period))
+                segments.append((state(1, m, s, 0), half_period))
+            segments.append((state(0, 0, 0, 0), rng.choice((1, half_period, 3 * half_period))))
+        segments.append((state(0, 0, 0, 1), rng.randint(1, idle)))
+    segments.append((state(0, 0, 0, 1), idle))
+    return _samples(segments), values
+
+def i2c_capture(seed=0, count=30, half_period=4, idle=20):
+    # I2C with SCL on channel 0 and SDA on channel 1: writes of 1 to 4 bytes (some of them NACKed) and register
+    # reads (the register address is written, then after a repeated START 1 to 4 bytes are read, the last one is
+    # NACKed). Returns the samples and the packets of the 'i2c' PD (without BITS) expected from the capture.
+    rng = random.Random(seed)
+    h = half_period
+    segments = [(3, idle)]
+    expected = []
+
+    def level(scl, sda, length):
+        segments.append((scl | (sda << 1), length))
+
+    def start(repeat=False):
+        if repeat:
+            level(0, 1, h)
+        level(1, 1, h)
+        level(1, 0, h)
+        level(0, 0, 1)
+        expected.append(['START REPEAT' if repeat else 'START', None])
+
+    def byte(value, nack, cmd, packet_value):
+        for i in range(7, -1, -1):
+            b = (value >> i) & 1
+            level(0, b, h)
+            level(1, b, h)
+            level(0, b, 1)
+        level(0, nack, h)
+        level(1, nack, h)
+        level(0, nack, 1)
+        expected.append([cmd, packet_value])
+        expected.append(['NACK' if nack else 'ACK', None])
+
+    def stop():
+        level(0, 0, h)
+        level(1, 0, h)
+        level(1, 1, h)
+        expected.append(['STOP', None])
+
+    for _ in range(count):
+        address = rng.randrange(8, 120)
+        start()
+        byte(address << 1, 0, 'ADDRESS WRITE', address)
+        if rng.random() < 0.5:
+            n = rng.randint(1, 4)
+            for i in range(n):
+                v = rng.randrange(256)
+                byte(v, int(i == n - 1 and rng.random() < 0.3), 'DATA WRITE', v)
+        else:
+            v = rng.randrange(256)
+            byte(v, 0, 'DATA WRITE', v)
+            start(repeat=True)
+            byte((address << 1) | 1, 0, 'ADDRESS READ', address)
+            n = rng.randint(1, 4)
+            for i in range(n):
+                v = rng.randrange(256)
+                byte(v, int(i == n - 1), 'DATA READ', v)
+        stop()
+        level(1, 1, rng.randint(1, idle))
+    return _samples(segments), expected
+
+CAPTURES = {
+    'uart': uart_capture,
+    'spi': spi_capture,
+    'i2c': i2c_capture,
+}
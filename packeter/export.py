@@ -0,0 +1,93 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2022 Matej Martinček <matomarss@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+
+'''
+Columnar export of the packets finished by the Packeter for bulk offline analysis.
+
+Every column is an append-only file of little-endian fixed-width values, one per packet:
+
+ss.u64, es.u64         start and end sample of the packet
+row.u8                 row of the packet
+type.u8                0 for address packets, 1 for data packets
+length.u32             number of values in the packet
+offsets.u64            offset of the end of the packet in payload.bin (the first packet starts at 0)
+payload.bin            values of all packets one after another (values wider than 8 bits modulo 256)
+
+columns.json describes the dtype of every column. The columns are buffered and written in large chunks, so they can
+be loaded (e.g. with load() of offline/export.py, which memory-maps them with NumPy) even while the decoding is still
+going on. The payload of a chunk is written before the other columns, which therefore never refer past its end.
+'''
+
+import json
+import os
+import sys
+from array import array
+
+COLUMNS = (
+    ('ss', 'ss.u64', 'Q', '<u8'),
+    ('es', 'es.u64', 'Q', '<u8'),
+    ('row', 'row.u8', 'B', '|u1'),
+    ('type', 'type.u8', 'B', '|u1'),
+    ('length', 'length.u32', 'I', '<u4'),
+    ('offsets', 'offsets.u64', 'Q', '<u8'),
+    ('payload', 'payload.bin', 'B', '|u1'),
+)
+
+class PacketExportWriter:
+    def __init__(self, directory, chunk_packets=1 << 16, chunk_payload=1 << 22):
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, 'columns.json'), 'w') as f:
+            json.dump({name: {'file': filename, 'dtype': dtype} for name, filename, _, dtype in COLUMNS}, f,
+                      indent=1)
+        self.files = [open(os.path.join(directory, filename), 'wb') for _, filename, _, _ in COLUMNS]
+        self.chunk_packets = chunk_packets
+        self.chunk_payload = chunk_payload
+        self.offset = 0
+        self.clear()
+
+    def clear(self):
+        self.columns = [array(typecode) for _, _, typecode, _ in COLUMNS[:-1]]
+        self.payload = bytearray()
+
+    def add(self, row, ptype, ss, es, values):
+        # Adds a finished packet, ptype is 0 for address packets and 1 for data packets
+        self.payload += bytes([v & 0xff for v in values])
+        self.offset += len(values)
+        for column, value in zip(self.columns, (ss, es, row, ptype, len(values), self.offset)):
+            column.append(value)
+        if len(self.columns[0]) >= self.chunk_packets or len(self.payload) >= self.chunk_payload:
+            self.flush()
+
+    def flush(self):
+        self.files[-1].write(self.payload)
+        self.files[-1].flush()
+        for f, column in zip(self.files, self.columns):
+            if sys.byteorder == 'big':
+                column.byteswap()
+            f.write(column.tobytes())
+            f.flush()
+        self.clear()
+
+    def close(self):
+        # May be called more than once (by reset() and when the decoder instance is freed)
+        if not self.files[-1].closed:
+            self.flush()
+            for f in self.files:
+                f.close()
@@ -0,0 +1,225 @@
+##
+## This file is part of the libsigrokdecode project.
+##
+## Copyright (C) 2022 Matej Martinček <matomarss@gmail.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, see <http://www.gnu.org/licenses/>.
+##
+
+'''
+Packet content index written by the Packeter and a query tool searching it.
+
+The index file starts with an 8 byte header followed by segments, each of them describing a run of consecutive
+packets, so that the index is written while decoding without holding all packets in memory. A segment consists of a
+32 byte header (magic, number of packets, payload length, number of keys, number of postings, id of its first
+packet) and the following little-endian arrays, each padded to 8 bytes:
+
+ss (u64), es (u64), payload offsets (u32, one more than packets), rows (u8), types (u8, 0 = address, 1 = data),
+payload (bytes), keys (u32, sorted 3-byte sequences), key offsets (u32, one more than keys), postings (u32, packet
+numbers within the segment)
+
+Values wider than 8 bits are stored modulo 256. The query tool memory-maps the file:
+
+python packeter/index.py packets.idx d,a          (hexadecimal values separated by , like the separator option)
+python packeter/index.py packets.idx --ascii OK
+'''
+
+import argparse
+import mmap
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+
+MAGIC = b'PKTIDX\x00\x01'
+SEGMENT = struct.Struct('<4sIIIIQ4x')
+SEGMENT_MAGIC = b'SEGM'
+
+def _padding(n):
+    return b'\x00' * (-n % 8)
+
+class PacketIndexWriter:
+    def __init__(self, path, segment_packets=1 << 16, segment_payload=1 << 24):
+        self.file = open(path, 'wb')
+        self.file.write(MAGIC)
+        self.segment_packets = segment_packets
+        self.segment_payload = segment_payload
+        self.first_id = 0
+        self.clear()
+
+    def clear(self):
+        self.ss = array('Q')
+        self.es = array('Q')
+        self.offsets = array('I', [0])
+        self.rows = array('B')
+        self.types = array('B')
+        self.payload = bytearray()
+        self.postings = {}
+
+    def add(self, row, ptype, ss, es, values):
+        # Adds a finished packet, ptype is 0 for address packets and 1 for data packets
+        n = len(self.ss)
+        data = bytes([v & 0xff for v in values])
+        self.ss.append(ss)
+        self.es.append(es)
+        self.rows.append(row)
+        self.types.append(ptype)
+        self.payload += data
+        self.offsets.append(len(self.payload))
+        postings = self.postings
+        for i in range(len(data) - 2):
+            key = (data[i] << 16) | (data[i + 1] << 8) | data[i + 2]
+            p = postings.get(key)
+            if p is None:
+                postings[key] = array('I', [n])
+            elif p[-1] != n:
+                p.append(n)
+        if len(self.ss) >= self.segment_packets or len(self.payload) >= self.segment_payload:
+            self.flush()
+
+    def flush(self):
+        # Writes the packets added until now as a segment
+        n = len(self.ss)
+        if n == 0:
+            return
+        keys = array('I', sorted(self.postings))
+        key_offsets = array('I', [0])
+        postings = array('I')
+        for k in keys:
+            postings.extend(self.postings[k])
+            key_offsets.append(len(postings))
+        self.file.write(SEGMENT.pack(SEGMENT_MAGIC, n, len(self.payload), len(keys), len(postings), self.first_id))
+        for a in (self.ss, self.es, self.offsets, self.rows, self.types, self.payload, keys, key_offsets,
+                  postings):
+            if sys.byteorder == 'big' and isinstance(a, array):
+                a = array(a.typecode, a)
+                a.byteswap()
+            data = bytes(a)
+            self.file.write(data + _padding(len(data)))
+        self.first_id += n
+        self.clear()
+
+    def close(self):
+        # May be called more than once (by reset() and when the decoder instance is freed)
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+class Segment:
+    def __init__(self, mm, pos):
+        magic, n, payload_len, n_keys, n_postings, self.first_id = SEGMENT.unpack_from(mm, pos)
+        if magic != SEGMENT_MAGIC:
+            raise ValueError('Corrupted index file (no segment at %d).' % pos)
+        self.n = n
+        pos += SEGMENT.size
+        view = memoryview(mm)
+
+        def take(typecode, count, size):
+            nonlocal pos
+            a = view[pos:pos + count * size]
+            if typecode != 'B' and sys.byteorder == 'big':
+                a = array(typecode, a)
+                a.byteswap()
+            else:
+                a = a.cast(typecode)
+            pos += count * size + (-count * size % 8)
+            return a
+
+        self.ss = take('Q', n, 8)
+        self.es = take('Q', n, 8)
+        self.offsets = take('I', n + 1, 4)
+        self.rows = take('B', n, 1)
+        self.types = take('B', n, 1)
+        self.payload = take('B', payload_len, 1)
+        self.keys = take('I', n_keys, 4)
+        self.key_offsets = take('I', n_keys + 1, 4)
+        self.postings = take('I', n_postings, 4)
+        self.end = pos
+
+    def payload_of(self, i):
+        return bytes(self.payload[self.offsets[i]:self.offsets[i + 1]])
+
+    def postings_of(self, key):
+        i = bisect_left(self.keys, key)
+        if i == len(self.keys) or self.keys[i] != key:
+            return None
+        return self.postings[self.key_offsets[i]:self.key_offsets[i + 1]]
+
+    def candidates(self, pattern):
+        # Packet numbers within the segment which may contain the pattern
+        if len(pattern) < 3:
+            return range(self.n)
+        best = None
+        for i in range(len(pattern) - 2):
+            p = self.postings_of((pattern[i] << 16) | (pattern[i + 1] << 8) | pattern[i + 2])
+            if p is None:
+                return []
+            if best is None or len(p) < len(best):
+                best = p
+        return best
+
+class PacketIndex:
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mm[:len(MAGIC)] != MAGIC:
+            raise ValueError('%s is not a packet index file.' % path)
+        self.segments = []
+        pos = len(MAGIC)
+        while pos < len(self.mm):
+            s = Segment(self.mm, pos)
+            self.segments.append(s)
+            pos = s.end
+
+    def __len__(self):
+        return sum(s.n for s in self.segments)
+
+    def packet(self, packet_id):
+        # (row, type, ss, es, payload) of a packet
+        for s in self.segments:
+            if packet_id < s.first_id + s.n:
+                i = packet_id - s.first_id
+                return s.rows[i], s.types[i], s.ss[i], s.es[i], s.payload_of(i)
+        raise IndexError(packet_id)
+
+    def find(self, pattern):
+        # Yields (packet id, row, type, ss, es, offset) for every occurrence of the byte sequence
+        pattern = bytes(pattern)
+        for s in self.segments:
+            for i in s.candidates(pattern):
+                data = s.payload_of(i)
+                offset = data.find(pattern)
+                while offset != -1:
+                    yield s.first_id + i, s.rows[i], s.types[i], s.ss[i], s.es[i], offset
+                    offset = data.find(pattern, offset + 1)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Find packets containing a sequence of bytes in a packet index.')
+    parser.add_argument('index', help='index file written by the Packeter')
+    parser.add_argument('pattern', nargs='?', help='hexadecimal values without 0x separated by , (e.g. d,a)')
+    parser.add_argument('--ascii', help='search for these ASCII characters instead')
+    args = parser.parse_args(argv)
+    if args.ascii is not None:
+        pattern = args.ascii.encode('ascii')
+    elif args.pattern:
+        pattern = bytes(int(v, 16) for v in args.pattern.split(','))
+    else:
+        parser.error('a pattern or --ascii is needed')
+
+    index = PacketIndex(args.index)
+    for packet_id, row, ptype, ss, es, offset in index.find(pattern):
+        print('packet %d row %d %s %d-%d offset %d' % (packet_id, row, ('address', 'data')[ptype], ss, es, offset))
+
+if __name__ == '__main__':
+    main()
@@ -17,16 +17,38 @@
 ## along with this program; if not, see <http://www.gnu.org/licenses/>.
 ##
 
+'''
+OUTPUT_PYTHON format (only if the pairing of packets is enabled):
+
+Transaction:
+['TRANSACTION', <request>, <response>, <latency>]
+
+<request> and <response> are the paired packets as [<ss>, <es>, <values>], where <values> is the list of values
+of the packet. <latency> is the number of samples between the end of the request and the start of the response.
+'''
 
 import re
 import sigrokdecode as srd
 from common.srdhelper import bcd2int, SrdIntEnum
 import math
+import weakref
+from collections import deque
+from .export import PacketExportWriter
+from .index import PacketIndexWriter
 
-a = ['ADDRESS', 'DATA', 'ADDRESS2', 'DATA2', ]
+a = ['ADDRESS', 'DATA', 'ADDRESS2', 'DATA2', 'TRANSACTION', ]
 
 Ann = SrdIntEnum.from_list('Ann', a)
 
+def format_time(t):
+    # Time in seconds with a suitable unit
+    if t == 0:
+        return '0 s'
+    for unit, factor in (('s', 1), ('ms', 1e3), ('us', 1e6)):
+        if t * factor >= 1:
+            return '%.3g %s' % (t * factor, unit)
+    return '%.3g ns' % (t * 1e9)
+
 class Decoder(srd.Decoder):
     api_version = 3
     id = 'packeter'
@@ -49,24 +71,51 @@ class Decoder(srd.Decoder):
          'default': 'no', 'values': ('yes', 'no')},
         {'id': 'display-separator-sequence', 'desc': 'Display separation sequence characters',
          'default': 'yes', 'values': ('yes', 'no')},
+        {'id': 'index-file', 'desc': 'File to write the packet content index to (none to disable)',
+         'default': 'none'},
+        {'id': 'export-dir', 'desc': 'Directory to export the packets to in columnar files (none to disable)',
+         'default': 'none'},
+        {'id': 'pair-packets', 'desc': 'Pair request packets with the following response packets',
+         'default': 'no', 'values': ('yes', 'no')},
+        {'id': 'request-row', 'desc': 'Row of the request packets (the other row has the responses)',
+         'default': 1, 'values': (0, 1)},
+        {'id': 'pair-window',
+         'desc': 'Maximal number of samples between a request and its response (0 for no limit)',
+         'default': 0},
+        {'id': 'pair-queue-size', 'desc': 'Maximal number of packets of each row waiting to be paired',
+         'default': 16},
     )
-    outputs = []
+    outputs = ['transactions']
     tags = ['Embedded/industrial']
     annotations = (
         ('address', 'Address'),
         ('data', 'Data'),
         ('address2', 'Address2'),
         ('data2', 'Data2'),
+        ('transaction', 'Transaction'),
     )
     annotation_rows = (
         ('first', 'First row', (Ann.ADDRESS, Ann.DATA,)),
         ('second', 'Second row', (Ann.ADDRESS2, Ann.DATA2,)),
+        ('transactions', 'Transactions', (Ann.TRANSACTION,)),
     )
 
     def __init__(self):
+        self.samplerate = None
+        self.index = None
+        self.export = None
         self.reset()
 
     def reset(self):
+        # The rest of the packet content index and of the export is written when the decoding is reset. sigrok-cli
+        # and PulseView do not reset the decoders after the last packet, see start() for that case.
+        if self.index is not None:
+            self.index.close()
+            self.index = None
+        if self.export is not None:
+            self.export.close()
+            self.export = None
+
         # Almost all global variables are remembered for each row separately
         self.ss = [0, 0]
         self.es = [0, 0]
@@ -74,14 +123,33 @@ class Decoder(srd.Decoder):
         self.current_row = 0
         self.stored_values = [[], []]
         self.separation_sequence_pointer_set = [{0}, {0}]
+        # Finished packets waiting to be paired (the queues are created in start(), when their size is known)
+        self.requests = None
+        self.responses = None
+
+    def metadata(self, key, value):
+        if key == srd.SRD_CONF_SAMPLERATE:
+            self.samplerate = value
 
     def start(self):
         self.out_ann = self.register(srd.OUTPUT_ANN)
+        self.out_python = self.register(srd.OUTPUT_PYTHON)
         # Split the separation sequence string at commas to create a list
         if self.options['use-separator-sequence'] == 'yes':
             self.separation_sequence = str(self.options['packet-separator-sequence']).split(',')
         else:
             self.separation_sequence = []
+        if self.options['index-file'] != 'none':
+            self.index = PacketIndexWriter(self.options['index-file'])
+            # Without reset(), the rest of the index is written when the instance is freed or the interpreter exits
+            weakref.finalize(self, self.index.close)
+        if self.options['export-dir'] != 'none':
+            self.export = PacketExportWriter(self.options['export-dir'])
+            # Likewise the rest of the export
+            weakref.finalize(self, self.export.close)
+        # When a queue is full, its oldest packet is dropped, e.g. if the responses to some requests are missing
+        self.requests = deque(maxlen=self.options['pair-queue-size'])
+        self.responses = deque(maxlen=self.options['pair-queue-size'])
 
     def manage_stored_values(self, t):
         if self.have_to_output():
@@ -91,22 +159,70 @@ class Decoder(srd.Decoder):
         # Outputs all values stored until now at the current row with the correct annotation type and at the correct row
         if len(self.stored_values[self.current_row]) == 0:
             return
+        output = self.get_output()
         if t == 'DATA':
             if self.current_row == 0:
-                self.put(self.ss[0], self.es[0], self.out_ann, [Ann.DATA, ['Data: ' + self.get_output(), 'Da', 'D']])
+                self.put(self.ss[0], self.es[0], self.out_ann, [Ann.DATA, ['Data: ' + output, 'Da', 'D']])
             elif self.current_row == 1:
-                self.put(self.ss[1], self.es[1], self.out_ann, [Ann.DATA2, ['Data: ' + self.get_output(), 'Da', 'D']])
+                self.put(self.ss[1], self.es[1], self.out_ann, [Ann.DATA2, ['Data: ' + output, 'Da', 'D']])
         elif t == 'ADDRESS':
             if self.current_row == 0:
-                self.put(self.ss[0], self.es[0], self.out_ann, [Ann.ADDRESS, ['Address: ' + self.get_output(), 'Add', 'A']])
+                self.put(self.ss[0], self.es[0], self.out_ann, [Ann.ADDRESS, ['Address: ' + output, 'Add', 'A']])
             elif self.current_row == 1:
-                self.put(self.ss[1], self.es[1], self.out_ann, [Ann.ADDRESS2, ['Address: ' + self.get_output(), 'Add', 'A']])
+                self.put(self.ss[1], self.es[1], self.out_ann, [Ann.ADDRESS2, ['Address: ' + output, 'Add', 'A']])
+
+        # Add the packet (as received, without the hidden separation sequence characters) to the index and export
+        for writer in (self.index, self.export):
+            if writer is not None:
+                writer.add(self.current_row, 0 if t == 'ADDRESS' else 1, self.ss[self.current_row],
+                            self.es[self.current_row], self.stored_values[self.current_row])
+
+        if self.options['pair-packets'] == 'yes':
+            self.pair_packets(self.ss[self.current_row], self.es[self.current_row],
+                              self.stored_values[self.current_row], output)
 
         # Resets the current state, stored values and separation sequence pointers for the current row
         self.state[self.current_row] = 'NEUTRAL'
         self.stored_values[self.current_row] = []
         self.separation_sequence_pointer_set[self.current_row] = {0}
 
+    def pair_packets(self, ss, es, values, output):
+        # Adds the finished packet of the current row to its queue and outputs all pairs of a request
+        # and the response following it found in the queues
+        if self.current_row == self.options['request-row']:
+            self.requests.append((ss, es, values, output))
+        else:
+            self.responses.append((ss, es, values, output))
+
+        while self.requests and self.responses:
+            response = self.responses.popleft()
+            # Of the requests ending before the response starts, the response belongs to the last one,
+            # the ones before it stay without a response
+            n = 0
+            while n < len(self.requests) and self.requests[n][1] <= response[0]:
+                n += 1
+            if n == 0:
+                # The response started before the end of all waiting requests, so it does not belong to any of them
+                continue
+            for _ in range(n - 1):
+                self.requests.popleft()
+            request = self.requests.popleft()
+            latency = response[0] - request[1]
+            if self.options['pair-window'] > 0 and latency > self.options['pair-window']:
+                continue
+            self.output_transaction(request, response, latency)
+
+    def output_transaction(self, request, response, latency):
+        if self.samplerate:
+            t = format_time(latency / self.samplerate)
+        else:
+            t = '%d samples' % latency
+        self.put(request[0], response[1], self.out_ann,
+                 [Ann.TRANSACTION, ['Transaction: ' + request[3] + ' -> ' + response[3] + ', latency ' + t,
+                                    'Latency: ' + t, 'T']])
+        self.put(request[0], response[1], self.out_python,
+                 ['TRANSACTION', list(request[:3]), list(response[:3]), latency])
+
     def have_to_output(self):
         # Returns True if the options indicate that a new packet should be started and the previous one finished
         return self.options['max-packet-length'] == len(self.stored_values[self.current_row]) or self.is_separated_by_sequence()